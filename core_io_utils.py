@@ -1,6 +1,6 @@
 import pandas as pd
 from io import BytesIO
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Iterable, List, Tuple
 import zipfile
 
 
@@ -325,4 +325,49 @@ def generate_pipeline_report(pipeline_output: Dict[str, Any]) -> str:
             f"- Μέγιστη διαφορά: {class_counts.max() - class_counts.min()}"
         ])
     
-    return "\n".join(report_lines)
\ No newline at end of file
+    return "\n".join(report_lines)
+
+def open_streaming_workbook(output_file: str):
+    """
+    Ανοίγει xlsxwriter Workbook σε constant_memory mode (γραμμή-γραμμή εγγραφή).
+    
+    Returns:
+        (workbook, header format όπως του pandas)
+    """
+    import xlsxwriter
+    # Ημερομηνίες ως ημερομηνίες (όχι αριθμοί Excel) και URLs ως απλό κείμενο, όπως το pandas
+    workbook = xlsxwriter.Workbook(output_file, {"constant_memory": True, "nan_inf_to_errors": True,
+                                                 "default_date_format": "yyyy-mm-dd hh:mm:ss",
+                                                 "strings_to_urls": False})
+    header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    return workbook, header_format
+
+
+def write_sheet_rows(workbook, sheet_name: str, layout: List[Tuple[Any, Optional[pd.Series]]],
+                     header_format=None, hidden: Iterable = ()):
+    """
+    Γράφει νέο φύλλο γραμμή-γραμμή (όπως απαιτεί το constant_memory).
+    
+    Args:
+        layout: Λίστα (header, στήλη) με τη σειρά του φύλλου· με στήλη None
+            γράφεται μόνο το header (π.χ. padding / fillers)
+        hidden: Headers στηλών που κρύβονται ήδη κατά την εγγραφή (χωρίς δεδομένα)
+    
+    Τα NaN μένουν κενά κελιά. Η διάταξη είναι θέσεων, οπότε επιτρέπονται και
+    διπλότυπα ονόματα στηλών.
+    """
+    ws = workbook.add_worksheet(sheet_name)
+    hidden = set(hidden)
+    for c, (header, _) in enumerate(layout):
+        if header in hidden:
+            ws.set_column(c, c, None, None, {"hidden": True})
+    ws.write_row(0, 0, [str(header) for header, _ in layout], header_format)
+    
+    data = [(c, column.tolist(), column.isna().tolist())
+            for c, (header, column) in enumerate(layout) if column is not None and header not in hidden]
+    n_rows = max((len(values) for _, values, _ in data), default=0)
+    for r in range(n_rows):
+        for c, values, missing in data:
+            if not missing[r]:
+                ws.write(r + 1, c, values[r])
+    return ws
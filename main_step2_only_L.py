@@ -16,6 +16,7 @@ from __future__ import annotations
 import argparse
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 
 # Εσωτερικές εισαγωγές
@@ -40,13 +41,55 @@ def _sid(c: str) -> int:
     m = re.search(r"ΣΕΝΑΡΙΟ[_\s]*(\d+)", str(c))
     return int(m.group(1)) if m else 0
 
-def run_step2_with_lock(input_step1_workbook: str, outdir: str, num_classes: int = 2, combine: bool = True):
+def _solve_scenario(df_step1: pd.DataFrame, col: str, num_classes: int, outdir: str):
+    """
+    Λύνει το Βήμα 2 για ένα σενάριο (στήλη ΒΗΜΑ1_ΣΕΝΑΡΙΟ_N) και γράφει το ατομικό του αρχείο.
+    Module-level ώστε να εκτελείται και σε worker process.
+
+    Returns:
+        (sid, best_df, στήλη Βήματος 1, στήλη Βήματος 2, αρχείο εξόδου)
+    """
+    sid = _sid(col)
+
+    results = step2.step2_apply_FIXED_v3(df_step1, step1_col_name=col, num_classes=num_classes, max_results=5)
+    if not results:
+        # pass-through (αν δεν επιστρέψει σενάρια)
+        best_name, best_df, best_metrics = ("option_1", df_step1.copy(), {"penalty": None})
+        # Βεβαιώσου ότι υπάρχει ένα ΒΗΜΑ2_ΣΕΝΑΡΙΟ_N (copy από ΒΗΜΑ1)
+        s2_col = f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{sid}"
+        best_df[s2_col] = best_df[col]
+    else:
+        best_name, best_df, best_metrics = results[0]
+        # Βρες την ακριβή στήλη ΒΗΜΑ2_ΣΕΝΑΡΙΟ_N
+        s2_candidates = [c for c in best_df.columns if str(c).startswith("ΒΗΜΑ2_ΣΕΝΑΡΙΟ_")]
+        s2_col = None
+        for c in s2_candidates:
+            if f"_{sid}" in str(c):
+                s2_col = c
+                break
+        if s2_col is None:
+            s2_col = s2_candidates[0] if s2_candidates else f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{sid}"
+            if s2_col not in best_df.columns:
+                best_df[s2_col] = best_df[col]
+
+    # Εξαγωγή ατομικού αρχείου
+    out_file = os.path.join(outdir, f"VIMA2_S{sid}_KL.xlsx")
+    exporter.export_step2_KL(best_df, out_file, step1_col_name=col, step2_col_name=s2_col, sheet_name=f"S{sid}")
+    return sid, best_df, col, s2_col, out_file
+
+def run_step2_with_lock(input_step1_workbook: str, outdir: str, num_classes: int = 2, combine: bool = True,
+                        workers: int = 1):
     """
     Διαβάζει το workbook του Βήματος 1 (με τις στήλες ΒΗΜΑ1_ΣΕΝΑΡΙΟ_*),
     τρέχει το Βήμα 2 για ΚΑΘΕ σενάριο και εξάγει αρχεία όπου:
     - K=ΒΗΜΑ1_ΣΕΝΑΡΙΟ_N
     - L=ΒΗΜΑ2_ΣΕΝΑΡΙΟ_N
     - Ένα φύλλο/σενάριο σε ένα ενιαίο workbook
+
+    Με workers > 1 (ή 0 = όσοι πυρήνες) τα σενάρια, που είναι ανεξάρτητα, λύνονται
+    παράλληλα σε process pool· κάθε worker γράφει το ατομικό αρχείο του μόλις
+    τελειώσει και το ενιαίο workbook συντίθεται στο τέλος από τα DataFrames
+    που επιστράφηκαν (χωρίς ξαναδιάβασμα αρχείων).
     """
     os.makedirs(outdir, exist_ok=True)
 
@@ -54,40 +97,21 @@ def run_step2_with_lock(input_step1_workbook: str, outdir: str, num_classes: int
     step1_cols = [c for c in df_step1.columns if str(c).startswith("ΒΗΜΑ1_ΣΕΝΑΡΙΟ_")]
     step1_cols = sorted(step1_cols, key=_sid)
 
-    per_scenario_outputs = []
-    dfs_for_combined = {}
-
-    for col in step1_cols:
-        sid = _sid(col)
-
-        results = step2.step2_apply_FIXED_v3(df_step1, step1_col_name=col, num_classes=num_classes, max_results=5)
-        if not results:
-            # pass-through (αν δεν επιστρέψει σενάρια)
-            best_name, best_df, best_metrics = ("option_1", df_step1.copy(), {"penalty": None})
-            # Βεβαιώσου ότι υπάρχει ένα ΒΗΜΑ2_ΣΕΝΑΡΙΟ_N (copy από ΒΗΜΑ1)
-            s2_col = f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{sid}"
-            best_df[s2_col] = best_df[col]
-        else:
-            best_name, best_df, best_metrics = results[0]
-            # Βρες την ακριβή στήλη ΒΗΜΑ2_ΣΕΝΑΡΙΟ_N
-            s2_candidates = [c for c in best_df.columns if str(c).startswith("ΒΗΜΑ2_ΣΕΝΑΡΙΟ_")]
-            s2_col = None
-            for c in s2_candidates:
-                if f"_{sid}" in str(c):
-                    s2_col = c
-                    break
-            if s2_col is None:
-                s2_col = s2_candidates[0] if s2_candidates else f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{sid}"
-                if s2_col not in best_df.columns:
-                    best_df[s2_col] = best_df[col]
-
-        # Εξαγωγή ατομικού αρχείου
-        out_file = os.path.join(outdir, f"VIMA2_S{sid}_KL.xlsx")
-        exporter.export_step2_KL(best_df, out_file, step1_col_name=col, step2_col_name=s2_col, sheet_name=f"S{sid}")
-        per_scenario_outputs.append(out_file)
-
-        # Συγκέντρωση για combined
-        dfs_for_combined[sid] = (best_df, col, s2_col)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(step1_cols)))
+
+    if workers == 1:
+        solved = [_solve_scenario(df_step1, col, num_classes, outdir) for col in step1_cols]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_solve_scenario, df_step1, col, num_classes, outdir) for col in step1_cols]
+            solved = [f.result() for f in as_completed(futures)]
+        solved.sort(key=lambda item: step1_cols.index(item[2]))
+
+    per_scenario_outputs = [out_file for *_, out_file in solved]
+    # Συγκέντρωση για combined
+    dfs_for_combined = {sid: (best_df, col, s2_col) for sid, best_df, col, s2_col, _ in solved}
 
     # Ενιαίο workbook με ένα φύλλο ανά σενάριο
     combined_path = os.path.join(outdir, "VIMA2_ALL_SCENARIOS_KL.xlsx")
@@ -105,9 +129,11 @@ def main():
     ap.add_argument("--outdir", required=True, help="Φάκελος εξόδου")
     ap.add_argument("--num-classes", type=int, default=2)
     ap.add_argument("--combine", action="store_true", help="(ignored, πάντα TRUE στο νέο exporter)")
+    ap.add_argument("--workers", type=int, default=1, help="Παράλληλα σενάρια (0 = όσοι πυρήνες, 1 = σειριακά)")
     args = ap.parse_args()
 
-    info = run_step2_with_lock(args.input, args.outdir, num_classes=args.num_classes, combine=True)
+    info = run_step2_with_lock(args.input, args.outdir, num_classes=args.num_classes, combine=True,
+                               workers=args.workers)
     print("OK")
     print("Input:", info["input"])
     print("Outputs:")
@@ -9,17 +9,43 @@
 """
 
 from dataclasses import dataclass, field
-from typing import Dict, List, Set, Tuple, Optional, FrozenSet
+from typing import Callable, Dict, List, Set, Tuple, Optional, FrozenSet, Sequence
 import pandas as pd
 import numpy as np
-import itertools
 import math
-
-# Σταθερά: η στήλη του σεναρίου στο Excel είναι ΠΑΝΤΑ η 'K'
-SCENARIO_COL_LETTER = 'K'
+import heapq
+import itertools
+import time
+import os
+import json
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import re
 import ast
 from pathlib import Path
+from core_io_utils import open_streaming_workbook, write_sheet_rows
+
+# Σταθερά: η στήλη του σεναρίου στο Excel είναι ΠΑΝΤΑ η 'K'
+SCENARIO_COL_LETTER = 'K'
+
+# Διαθέσιμες μέθοδοι αναζήτησης σεναρίων του Κανόνα 2
+SEARCH_MODES = ("exhaustive", "bnb", "components")
+
+# Μέγιστο πλήθος υποψήφιων γραμμών ανά μπλοκ στην εξαντλητική αξιολόγηση (NumPy)
+_BLOCK_ROWS = 65536
+
+# Κάθε πόσα βήματα DFS ελέγχεται το χρονικό όριο της αναζήτησης
+_BUDGET_CHECK_STEPS = 1024
+
+# Μέγιστο πλήθος αποθηκευμένων αποτελεσμάτων στο cache σεναρίων (LRU)
+_CACHE_MAX_ENTRIES = 64
+
+# Πρόθεμα των αρχείων του cache: μόνο αυτά διαβάζονται / διαγράφονται στον cache_dir
+_CACHE_PREFIX = "step1-"
+
+# Τιμές που σημαίνουν "Ν" (μετά από strip/upper)
+_YES_VALUES = ("Ν", "ΝΑΙ", "YES", "TRUE", "1", "Y")
 
 
 @dataclass(frozen=True)
@@ -41,6 +67,31 @@ class Step1Scenario:
         return [name for name, cls in self.assignments.items() if cls == class_name]
 
 
+@dataclass(frozen=True)
+class FriendshipMatrix:
+    """
+    Αραιός (COO) πίνακας γειτνίασης φιλιών μεταξύ παιδιών εκπαιδευτικών.
+    
+    Η γραμμή rows[i] δήλωσε ως φίλο τη στήλη cols[i] (δείκτες στο names).
+    Οι αμοιβαίες φιλίες είναι το A & A.T.
+    """
+    names: Tuple[str, ...]
+    rows: np.ndarray
+    cols: np.ndarray
+    
+    def mutual_edges(self) -> List[Tuple[int, int]]:
+        """Αμοιβαίες φιλίες ως ζεύγη δεικτών (i < j), δηλαδή το A & A.T"""
+        n = len(self.names)
+        keys = self.rows * n + self.cols
+        mutual = (self.rows < self.cols) & np.isin(keys, self.cols * n + self.rows)
+        pairs = np.unique(keys[mutual])
+        return [(int(k // n), int(k % n)) for k in pairs]
+    
+    def mutual_pairs(self) -> FrozenSet[Tuple[str, str]]:
+        """Αμοιβαίες φιλίες ως ζεύγη ονομάτων (σε sorted σειρά)"""
+        return frozenset(tuple(sorted((self.names[i], self.names[j]))) for i, j in self.mutual_edges())
+
+
 @dataclass(frozen=True)
 class Step1Results:
     """Immutable αποτελέσματα βήματος 1"""
@@ -66,35 +117,87 @@ class Step1Results:
     
     def validate_immutability(self, df: pd.DataFrame) -> bool:
         """Ελέγχει ότι οι στήλες ΒΗΜΑ1_ΣΕΝΑΡΙΟ_X δεν έχουν αλλάξει"""
+        # Πρώτη γραμμή ανά όνομα, όπως ο έλεγχος ανά μαθητή (iloc[0])
+        first_rows = df.drop_duplicates("ΟΝΟΜΑ", keep="first").set_index("ΟΝΟΜΑ")
         for scenario in self.scenarios:
             col_name = scenario.column_name
             if col_name not in df.columns:
                 raise ValueError(f"Λείπει στήλη {col_name} - παραβίαση immutability")
             
-            # Έλεγχος ότι οι αναθέσεις είναι οι αναμενόμενες
-            for student_name, expected_class in scenario.assignments.items():
-                student_row = df[df["ΟΝΟΜΑ"] == student_name]
-                if student_row.empty:
-                    continue
-                
-                actual_class = student_row[col_name].iloc[0]
-                if pd.notna(actual_class) and str(actual_class).strip() != expected_class:
-                    raise ValueError(
-                        f"ΠΑΡΑΒΙΑΣΗ IMMUTABILITY: {student_name} σε {col_name} "
-                        f"αναμενόταν '{expected_class}', βρέθηκε '{actual_class}'"
-                    )
+            # Έλεγχος ότι οι αναθέσεις είναι οι αναμενόμενες (ένα reindex ανά στήλη)
+            expected = pd.Series(scenario.assignments, dtype=object)
+            actual = first_rows[col_name].reindex(expected.index)
+            violations = actual.notna() & (actual.astype(str).str.strip() != expected)
+            if violations.any():
+                student_name = violations.idxmax()
+                raise ValueError(
+                    f"ΠΑΡΑΒΙΑΣΗ IMMUTABILITY: {student_name} σε {col_name} "
+                    f"αναμενόταν '{expected[student_name]}', βρέθηκε '{actual[student_name]}'"
+                )
         return True
 
 
+class _SearchBudget:
+    """
+    Όριο χρόνου / υποψηφίων και αναφορά προόδου για την αναζήτηση σεναρίων.
+    
+    Η αναζήτηση καλεί charge() καθώς αξιολογεί υποψήφια σενάρια· όταν επιστρέψει
+    True σταματά και κρατά τα καλύτερα ως τώρα (exhausted = True). Δεν σταματά
+    ποτέ πριν αξιολογηθεί τουλάχιστον ένα σενάριο.
+    """
+    
+    def __init__(self, budget_seconds: Optional[float] = None, max_candidates: Optional[int] = None,
+                 progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                 report_interval: float = 0.5, start: bool = True):
+        self.budget_seconds = budget_seconds
+        self.deadline: Optional[float] = None
+        if start:
+            self.start()
+        self.max_candidates = max_candidates
+        self.progress = progress
+        self.report_interval = report_interval
+        self.examined = 0
+        self.exhausted = False
+        self._last_report = 0.0
+    
+    def charge(self, count: int = 0, best_broken: Optional[int] = None) -> bool:
+        """Καταγράφει count νέους υποψηφίους· True αν η αναζήτηση πρέπει να σταματήσει"""
+        self.examined += count
+        now = time.time()
+        if self.progress is not None and now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.progress(self.examined, best_broken)
+        if self.examined > 0 and (
+                (self.deadline is not None and now >= self.deadline)
+                or (self.max_candidates is not None and self.examined >= self.max_candidates)):
+            self.exhausted = True
+        return self.exhausted
+    
+    def start(self) -> None:
+        """Ξεκινά το ρολόι του χρονικού ορίου (στα shards: όταν ξεκινήσει ο worker)"""
+        if self.budget_seconds is not None:
+            self.deadline = time.time() + self.budget_seconds
+    
+    def remaining_seconds(self) -> Optional[float]:
+        """Υπόλοιπος χρόνος (για τα shards της παράλληλης αναζήτησης)"""
+        return None if self.deadline is None else max(0.0, self.deadline - time.time())
+
+
 class Step1ImmutableProcessor:
     """Επεξεργαστής που εξασφαλίζει immutability του Βήματος 1"""
     
     def __init__(self):
         self._results: Optional[Step1Results] = None
         self._is_locked: bool = False
+        self._friendship_matrix: Optional[FriendshipMatrix] = None
     
-    def create_scenarios(self, df: pd.DataFrame, num_classes: Optional[int] = None) -> Step1Results:
-        """Δημιουργία immutable σεναρίων"""
+    def create_scenarios(self, df: pd.DataFrame, num_classes: Optional[int] = None,
+                         search: str = "exhaustive", workers: Optional[int] = None,
+                         budget_seconds: Optional[float] = None, max_candidates: Optional[int] = None,
+                         progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                         cache_dir: Optional[str] = None,
+                         cache_max_entries: int = _CACHE_MAX_ENTRIES) -> Step1Results:
+        """Δημιουργία immutable σεναρίων (search: "exhaustive", "bnb" ή "components")"""
         if self._is_locked:
             raise RuntimeError("Step1 είναι ήδη κλειδωμένο - δεν επιτρέπονται αλλαγές")
         
@@ -124,8 +227,21 @@ class Step1ImmutableProcessor:
         # Εξαγωγή φιλιών
         friendships = self._extract_friendships(df_norm, teacher_kids)
         
+        # Cache: ίδια είσοδος -> ίδια σενάρια, χωρίς νέα αναζήτηση
+        cache_key = None
+        if cache_dir is not None:
+            cache_key = _cache_key(teacher_kids, friendships, num_classes, search)
+            cached = _load_cached_results(cache_dir, cache_key)
+            if cached is not None:
+                print(f"Φόρτωση {len(cached.scenarios)} σεναρίων από cache ({cache_key[:12]})")
+                self._results = cached
+                return self._results
+        
         # Δημιουργία σεναρίων
-        scenarios = self._generate_scenarios(teacher_kids, num_classes, friendships)
+        scenarios = self._generate_scenarios(teacher_kids, num_classes, friendships,
+                                             search=search, workers=workers,
+                                             budget_seconds=budget_seconds, max_candidates=max_candidates,
+                                             progress=progress)
         
         # Δημιουργία immutable αποτελεσμάτων
         self._results = Step1Results(
@@ -137,6 +253,10 @@ class Step1ImmutableProcessor:
         )
         
         print(f"Δημιουργήθηκαν {len(scenarios)} immutable σενάρια")
+        
+        # Αποτελέσματα διακοπείσας αναζήτησης δεν αποθηκεύονται
+        if cache_key is not None and not any(s.metadata.get("search_truncated") for s in scenarios):
+            _store_cached_results(cache_dir, cache_key, self._results, cache_max_entries)
         return self._results
     
     def apply_to_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -149,13 +269,8 @@ class Step1ImmutableProcessor:
         # Προσθήκη στηλών ΒΗΜΑ1_ΣΕΝΑΡΙΟ_X
         for scenario in self._results.scenarios:
             col_name = scenario.column_name
-            result_df[col_name] = ""  # Αρχικοποίηση με κενές τιμές
-            
-            # Συμπλήρωση μόνο για παιδιά εκπαιδευτικών
-            for student_name, class_assigned in scenario.assignments.items():
-                mask = result_df["ΟΝΟΜΑ"] == student_name
-                if mask.any():
-                    result_df.loc[mask, col_name] = class_assigned
+            # Συμπλήρωση μόνο για παιδιά εκπαιδευτικών, κενό για τους υπόλοιπους
+            result_df[col_name] = result_df["ΟΝΟΜΑ"].map(scenario.assignments).fillna("")
         
         # ΚΛΕΙΔΩΜΑ - μετά από αυτό δεν επιτρέπονται αλλαγές
         self._is_locked = True
@@ -167,6 +282,10 @@ class Step1ImmutableProcessor:
         """Read-only πρόσβαση στα αποτελέσματα"""
         return self._results
     
+    def get_friendship_matrix(self) -> Optional[FriendshipMatrix]:
+        """Ο αραιός πίνακας φιλιών της τελευταίας create_scenarios (None αν δεν υπάρχει)"""
+        return self._friendship_matrix
+    
     def is_locked(self) -> bool:
         """Έλεγχος αν το Step1 είναι κλειδωμένο"""
         return self._is_locked
@@ -212,14 +331,14 @@ class Step1ImmutableProcessor:
         }).fillna("")
         
         for c in ["ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ", "ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ"]:
-            result[c] = result[c].map(self._norm_yesno)
+            result[c] = np.where(_yes_mask(result[c].to_numpy()), "Ν", "Ο")
         
         return result
     
     def _norm_yesno(self, val) -> str:
         """Κανονικοποίηση Ν/Ο τιμών"""
         s = str(val).strip().upper()
-        return "Ν" if s in {"Ν", "ΝΑΙ", "YES", "TRUE", "1", "Y"} else "Ο"
+        return "Ν" if s in _YES_VALUES else "Ο"
     
     def _get_teacher_kids(self, df: pd.DataFrame) -> List[str]:
         """Εντοπισμός παιδιών εκπαιδευτικών"""
@@ -240,34 +359,35 @@ class Step1ImmutableProcessor:
     
     def _extract_friendships(self, df: pd.DataFrame, teacher_kids: List[str]) -> FrozenSet[Tuple[str, str]]:
         """Εξαγωγή αμοιβαίων φιλιών μεταξύ παιδιών εκπαιδευτικών"""
-        teacher_kids_set = set(teacher_kids)
-        student_friends = {}
+        names = tuple(dict.fromkeys(teacher_kids))
+        kid_index = {name: i for i, name in enumerate(names)}
+        rows = np.empty(0, dtype=np.int64)
+        cols = np.empty(0, dtype=np.int64)
         
         # ΜΕΘΟΔΟΣ 1: Matrix-style (στήλες με ονόματα)
         friendship_cols = self._find_friendship_columns(df)
         if friendship_cols:
             print(f"Εντοπίστηκαν {len(friendship_cols)} στήλες φιλιών (matrix-style)")
             
-            for col in friendship_cols:
-                friend_name = str(col).strip()
-                if friend_name in teacher_kids_set:
-                    # Βρες ποια παιδιά εκπαιδευτικών έχουν γράψει το friend_name ως φίλο
-                    friend_mask = (df["ΟΝΟΜΑ"].isin(teacher_kids)) & (df[col].map(self._norm_yesno) == "Ν")
-                    students_who_wrote_this_friend = df[friend_mask]["ΟΝΟΜΑ"].tolist()
-                    
-                    for student in students_who_wrote_this_friend:
-                        if student != friend_name:  # Όχι φιλία με τον εαυτό του
-                            if student not in student_friends:
-                                student_friends[student] = set()
-                            student_friends[student].add(friend_name)
+            # Ένα πέρασμα σε όλο το μπλοκ: γραμμές/στήλες παιδιών εκπαιδευτικών, Ν/Ο διανυσματικά
+            kid_cols = [(col, kid_index[str(col).strip()]) for col in friendship_cols
+                        if str(col).strip() in kid_index]
+            row_index = df["ΟΝΟΜΑ"].map(kid_index)
+            kid_rows = row_index.notna().to_numpy()
+            if kid_cols and kid_rows.any():
+                block = df.loc[kid_rows, [col for col, _ in kid_cols]]
+                r, c = np.nonzero(_yes_mask(block.to_numpy()))
+                rows = row_index[kid_rows].to_numpy(dtype=np.int64)[r]
+                cols = np.array([j for _, j in kid_cols], dtype=np.int64)[c]
         
         # ΜΕΘΟΔΟΣ 2: Single-column ΦΙΛΟΙ (fallback)
         elif "ΦΙΛΟΙ" in df.columns:
             print("Χρήση στήλης ΦΙΛΟΙ (single-column)")
             
+            student_friends = {}
             for _, row in df.iterrows():
                 student_name = str(row["ΟΝΟΜΑ"]).strip()
-                if student_name in teacher_kids_set:
+                if student_name in kid_index:
                     friends_str = str(row["ΦΙΛΟΙ"]).strip()
                     if friends_str and friends_str.lower() not in ["", "nan", "none"]:
                         # Split με διάφορα separators
@@ -280,26 +400,25 @@ class Step1ImmutableProcessor:
                             friends_list = [friends_str.strip()]  # Single friend
                         
                         # Φιλτράρισμα μόνο παιδιών εκπαιδευτικών
-                        valid_friends = [f for f in friends_list if f in teacher_kids_set and f != student_name]
+                        valid_friends = [f for f in friends_list if f in kid_index and f != student_name]
                         
                         if valid_friends:
                             student_friends[student_name] = set(valid_friends)
+            
+            declared = [(kid_index[a], kid_index[b]) for a, friends in student_friends.items() for b in friends]
+            rows = np.array([a for a, _ in declared], dtype=np.int64)
+            cols = np.array([b for _, b in declared], dtype=np.int64)
         
         else:
             print("Δεν βρέθηκαν στήλες φιλιών")
         
-        # Έλεγχος αμοιβαιότητας: A→B ΚΑΙ B→A
-        friendships = set()
-        for student_a in student_friends:
-            friends_of_a = student_friends[student_a]
-            for student_b in friends_of_a:
-                if student_b in student_friends and student_a in student_friends[student_b]:
-                    # Αμοιβαία φιλία βρέθηκε - προσθήκη με sorted order
-                    pair = tuple(sorted([student_a, student_b]))
-                    friendships.add(pair)
+        # Όχι φιλία με τον εαυτό του· αμοιβαιότητα (A→B ΚΑΙ B→A) = A & A.T
+        not_self = rows != cols
+        self._friendship_matrix = FriendshipMatrix(names=names, rows=rows[not_self], cols=cols[not_self])
+        friendships = self._friendship_matrix.mutual_pairs()
         
         print(f"Βρέθηκαν {len(friendships)} αμοιβαίες φιλίες μεταξύ παιδιών εκπαιδευτικών")
-        return frozenset(friendships)
+        return friendships
     
     def _count_broken_friendships(self, teacher_kids: List[str], assign_map: Dict[str, str], 
                                friendships: FrozenSet[Tuple[str, str]]) -> int:
@@ -310,17 +429,15 @@ class Step1ImmutableProcessor:
                 broken += 1
         return broken
     
-    def _canonical_key(self, names: List[str], assign_map: Dict[str, str], class_labels_list: List[str]) -> Tuple:
-        """Canonical key για αποφυγή duplicates"""
-        buckets = []
-        for c in class_labels_list:
-            members = tuple(sorted([n for n in names if assign_map.get(n) == c]))
-            buckets.append(members)
-        return tuple(sorted(buckets))
-    
     def _generate_scenarios(self, teacher_kids: List[str], num_classes: int, 
-                          friendships: FrozenSet[Tuple[str, str]]) -> List[Step1Scenario]:
+                          friendships: FrozenSet[Tuple[str, str]],
+                          search: str = "exhaustive", workers: Optional[int] = None,
+                          budget_seconds: Optional[float] = None, max_candidates: Optional[int] = None,
+                          progress: Optional[Callable[[int, Optional[int]], None]] = None) -> List[Step1Scenario]:
         """Δημιουργία σεναρίων με immutable structure"""
+        if search not in SEARCH_MODES:
+            raise ValueError(f"Άγνωστη μέθοδος αναζήτησης: {search} (διαθέσιμες: {', '.join(SEARCH_MODES)})")
+        
         class_labels_list = [f"Α{i+1}" for i in range(num_classes)]
         scenarios = []
         
@@ -342,8 +459,30 @@ class Step1ImmutableProcessor:
             scenarios.append(scenario)
         else:
             # ΚΑΝΟΝΑΣ 2: Εξαντλητική παραγωγή
-            print(f"Εφαρμογή Κανόνα 2 (εξαντλητική με φιλίες)")
-            valid_assignments = self._exhaustive_generation(teacher_kids, num_classes, friendships)
+            budget = None
+            if budget_seconds is not None or max_candidates is not None or progress is not None:
+                budget = _SearchBudget(budget_seconds, max_candidates, progress)
+            
+            if search == "bnb":
+                print(f"Εφαρμογή Κανόνα 2 (branch-and-bound με φιλίες)")
+                valid_assignments = self._branch_and_bound_generation(teacher_kids, num_classes, friendships,
+                                                                      workers=workers, budget=budget)
+            elif search == "components":
+                print(f"Εφαρμογή Κανόνα 2 (ανά συνιστώσα φιλιών)")
+                valid_assignments = self._component_generation(teacher_kids, num_classes, friendships,
+                                                               budget=budget)
+            else:
+                print(f"Εφαρμογή Κανόνα 2 (εξαντλητική με φιλίες)")
+                valid_assignments = self._exhaustive_generation(teacher_kids, num_classes, friendships,
+                                                                workers=workers, budget=budget)
+            
+            truncated = budget is not None and budget.exhausted
+            if budget is not None:
+                if budget.progress is not None:
+                    budget.progress(budget.examined, min((b for _, b in valid_assignments), default=None))
+                if truncated:
+                    print(f"ΔΙΑΚΟΠΗ: εξαντλήθηκε το όριο αναζήτησης μετά από {budget.examined:,} "
+                          f"υποψήφια - κρατούνται τα καλύτερα σενάρια ως τώρα")
             
             for i, (assignments_dict, broken_count) in enumerate(valid_assignments[:5], 1):
                 scenario = Step1Scenario(
@@ -351,92 +490,880 @@ class Step1ImmutableProcessor:
                     column_name=f"ΒΗΜΑ1_ΣΕΝΑΡΙΟ_{i}",
                     assignments=assignments_dict,
                     description="Κανόνας 2: Ισόρροπη κατανομή",
-                    broken_friendships=broken_count
+                    broken_friendships=broken_count,
+                    metadata={"search_truncated": truncated}
                 )
                 scenarios.append(scenario)
         
         return scenarios
     
     def _exhaustive_generation(self, teacher_kids: List[str], num_classes: int, 
-                             friendships: FrozenSet[Tuple[str, str]]) -> List[Tuple[Dict[str, str], int]]:
+                             friendships: FrozenSet[Tuple[str, str]],
+                             workers: Optional[int] = None,
+                             budget: Optional[_SearchBudget] = None) -> List[Tuple[Dict[str, str], int]]:
         """Εξαντλητική παραγωγή σεναρίων"""
         class_labels_list = [f"Α{i+1}" for i in range(num_classes)]
-        valid_scenarios = []
-        seen_canonical = set()
+        index = {name: i for i, name in enumerate(teacher_kids)}
+        edges = [(index[a], index[b]) for a, b in friendships if a in index and b in index]
         
         print(f"Παραγωγή σεναρίων για {len(teacher_kids)} παιδιά σε {num_classes} τμήματα...")
         
-        # Εξαντλητική παραγωγή
-        total_combinations = num_classes ** len(teacher_kids)
+        # Παράγονται ΜΟΝΟ ισόρροπες (diff ≤1) canonical κατανομές, άρα δεν
+        # χρειάζεται φιλτράρισμα ανισοκατανομής ή duplicates εδώ
+        total_combinations = _count_balanced_partitions(len(teacher_kids), num_classes)
         print(f"Συνολικές περιπτώσεις: {total_combinations:,}")
         
-        for assignment in itertools.product(class_labels_list, repeat=len(teacher_kids)):
-            assign_map = {teacher_kids[i]: assignment[i] for i in range(len(teacher_kids))}
-            
-            # ΕΛΕΓΧΟΣ 1: Ισοκατανομή ≤1
-            class_counts = {c: 0 for c in class_labels_list}
-            for name in teacher_kids:
-                class_counts[assign_map[name]] += 1
-            
-            counts_list = list(class_counts.values())
-            if max(counts_list) - min(counts_list) > 1:
-                continue  # Απόρριψη ανισοκατανομής >1
-            
-            # ΕΛΕΓΧΟΣ 2: Όχι όλα στο ίδιο τμήμα
-            unique_classes = set(assign_map.values())
-            if len(unique_classes) == 1:
-                continue  # Απόρριψη
-            
-            # ΕΛΕΓΧΟΣ 3: Canonical uniqueness
-            canon_key = self._canonical_key(teacher_kids, assign_map, class_labels_list)
-            if canon_key in seen_canonical:
-                continue
-            seen_canonical.add(canon_key)
-            
-            # Υπολογισμός σπασμένων φιλιών
-            broken_friendships = self._count_broken_friendships(teacher_kids, assign_map, friendships)
-            
-            valid_scenarios.append((assign_map, broken_friendships))
-        
-        print(f"Έγκυρα σενάρια: {len(valid_scenarios)}")
+        entries, valid_count, zero_count, _ = _run_search("exhaustive", len(teacher_kids), num_classes,
+                                                           edges, workers, budget)
+        print(f"Έγκυρα σενάρια: {valid_count}")
         
-        # Φιλτράρισμα αν >5
-        if len(valid_scenarios) > 5:
+        # Φιλτράρισμα αν >5 (ή αν η αναζήτηση διακόπηκε πριν εξεταστούν όλα)
+        more_than_top = valid_count > 5 or (budget is not None and budget.exhausted)
+        best = _select_top(entries, more_than_top)
+        if more_than_top and best:
             print("Εφαρμογή φιλτραρίσματος...")
             
             # Προτεραιότητα σε σενάρια με λιγότερα σπασμένα φιλιά
-            min_broken = min(s[1] for s in valid_scenarios)
+            min_broken = best[0][1]
             if min_broken == 0:
-                scenarios_without_breaks = [s for s in valid_scenarios if s[1] == 0]
-                print(f"Βρέθηκαν {len(scenarios_without_breaks)} σενάρια χωρίς σπασμένες φιλίες")
-                valid_scenarios = scenarios_without_breaks
+                print(f"Βρέθηκαν {zero_count} σενάρια χωρίς σπασμένες φιλίες")
             else:
                 print(f"Όλα σπάζουν φιλίες (min: {min_broken}) - ταξινόμηση")
-                valid_scenarios.sort(key=lambda x: x[1])
-            
-            # Τελική επιλογή 5 σεναρίων
-            if len(valid_scenarios) > 5:
-                valid_scenarios = valid_scenarios[:5]
         
+        valid_scenarios = [
+            ({name: class_labels_list[c] for name, c in zip(teacher_kids, labels)}, broken)
+            for labels, broken in best
+        ]
         print(f"Τελική επιλογή: {len(valid_scenarios)} σενάρια")
         return valid_scenarios
+    
+    def _branch_and_bound_generation(self, teacher_kids: List[str], num_classes: int,
+                                     friendships: FrozenSet[Tuple[str, str]],
+                                     workers: Optional[int] = None,
+                                     budget: Optional[_SearchBudget] = None) -> List[Tuple[Dict[str, str], int]]:
+        """
+        Branch-and-bound αναζήτηση των 5 καλύτερων σεναρίων.
+        
+        Δίνει τα ίδια σενάρια (και με την ίδια σειρά) με την εξαντλητική παραγωγή,
+        αλλά κρατά μόνο heap 5 θέσεων αντί για όλα τα έγκυρα σενάρια.
+        """
+        class_labels_list = [f"Α{i+1}" for i in range(num_classes)]
+        index = {name: i for i, name in enumerate(teacher_kids)}
+        edges = [(index[a], index[b]) for a, b in friendships if a in index and b in index]
+        
+        print(f"Branch-and-bound για {len(teacher_kids)} παιδιά σε {num_classes} τμήματα...")
+        entries, leaves, _, pruned = _run_search("bnb", len(teacher_kids), num_classes, edges, workers, budget)
+        print(f"Εξετάστηκαν {leaves:,} πλήρη σενάρια" + (" (με κλάδεμα)" if pruned else ""))
+        
+        more_than_top = leaves > 5 or pruned or (budget is not None and budget.exhausted)
+        valid_scenarios = [
+            ({name: class_labels_list[c] for name, c in zip(teacher_kids, labels)}, broken)
+            for labels, broken in _select_top(entries, more_than_top)
+        ]
+        print(f"Τελική επιλογή: {len(valid_scenarios)} σενάρια")
+        return valid_scenarios
+    
+    def _component_generation(self, teacher_kids: List[str], num_classes: int,
+                              friendships: FrozenSet[Tuple[str, str]],
+                              budget: Optional[_SearchBudget] = None) -> List[Tuple[Dict[str, str], int]]:
+        """
+        Αναζήτηση ανά συνιστώσα του γράφου φιλιών.
+        
+        Δίνει τα ίδια πλήθη σπασμένων φιλιών με την εξαντλητική παραγωγή· μεταξύ
+        ισοβαθμούντων σεναρίων μπορεί να επιλεγούν διαφορετικοί αντιπρόσωποι.
+        """
+        class_labels_list = [f"Α{i+1}" for i in range(num_classes)]
+        index = {name: i for i, name in enumerate(teacher_kids)}
+        edges = [(index[a], index[b]) for a, b in friendships if a in index and b in index]
+        
+        components = _friendship_components(len(teacher_kids), edges)
+        groups = [c for c in components if len(c) > 1]
+        print(f"Συνιστώσες φιλιών: {len(groups)} (μέγιστη: {max((len(g) for g in groups), default=0)} παιδιά), "
+              f"μεμονωμένα παιδιά: {len(components) - len(groups)}")
+        best, leaves, pruned = _component_top(len(teacher_kids), num_classes, edges, budget=budget)
+        print(f"Εξετάστηκαν {leaves:,} πλήρη σενάρια" + (" (με κλάδεμα)" if pruned else ""))
+        
+        valid_scenarios = [
+            ({name: class_labels_list[c] for name, c in zip(teacher_kids, labels)}, broken)
+            for labels, broken in best
+        ]
+        print(f"Τελική επιλογή: {len(valid_scenarios)} σενάρια")
+        return valid_scenarios
+
+
+def _yes_mask(values: np.ndarray) -> np.ndarray:
+    """Διανυσματική εκδοχή του _norm_yesno: True όπου η τιμή σημαίνει "Ν" """
+    text = np.char.upper(np.char.strip(np.asarray(values).astype(str)))
+    return np.isin(text, _YES_VALUES)
+
+
+# === ΠΑΡΑΓΩΓΗ ΙΣΟΡΡΟΠΩΝ ΚΑΤΑΝΟΜΩΝ ===
+
+def _count_balanced_partitions(n: int, num_classes: int) -> int:
+    """Πλήθος ισόρροπων (diff ≤1) canonical κατανομών n παιδιών σε num_classes τμήματα"""
+    if n < 2 or num_classes < 2:
+        return 0
+    q, r = divmod(n, num_classes)
+    denominator = (math.factorial(q + 1) ** r * math.factorial(q) ** (num_classes - r)
+                   * math.factorial(r) * (math.factorial(num_classes - r) if q else 1))
+    return math.factorial(n) // denominator
+
+
+def _balanced_partitions(n: int, num_classes: int, depth: Optional[int] = None,
+                         prefix: Tuple[int, ...] = ()):
+    """
+    Παράγει ΜΟΝΟ τις ισόρροπες (diff ≤1), canonical κατανομές n παιδιών.
+    Με `depth` < n παράγει τα προθέματα μήκους depth που έχουν έγκυρη συνέχεια,
+    και με `prefix` μόνο όσα ξεκινούν με το δοσμένο (έγκυρο) πρόθεμα.
+    
+    Κάθε κατανομή είναι tuple δεικτών τμήματος σε μορφή restricted growth string:
+    το πρώτο παιδί πάει στο τμήμα 0 και κάθε νέο τμήμα παίρνει τον επόμενο δείκτη.
+    Αυτός είναι ο αντιπρόσωπος που κρατούσε το itertools.product (πρώτη εμφάνιση
+    κάθε διαμέρισης) και η σειρά παραγωγής είναι η ίδια λεξικογραφική σειρά.
+    Κάθε κλάδος που ανοίγει καταλήγει σε έγκυρη κατανομή, άρα το κόστος είναι
+    ανάλογο του πλήθους των έγκυρων σεναρίων.
+    """
+    if n < 2 or num_classes < 2:
+        return
+    depth = n if depth is None else depth
+    start = len(prefix)
+    if depth <= start:
+        yield tuple(prefix[:depth])
+        return
+    q, r = divmod(n, num_classes)
+    counts = [0] * num_classes
+    labels = list(prefix) + [-1] * (depth - start)
+    opened = [0] * (depth + 1)  # opened[i] = τμήματα σε χρήση πριν το παιδί i
+    for c in prefix:
+        counts[c] += 1
+    full = sum(1 for c in counts if c == q + 1)  # τμήματα με q+1 (το πολύ r)
+    opened[start] = max(prefix) + 1 if prefix else 0
+    
+    i = start
+    while i >= start:
+        # Αναίρεση της προηγούμενης επιλογής στο επίπεδο i
+        c = labels[i]
+        if c >= 0:
+            if counts[c] == q + 1:
+                full -= 1
+            counts[c] -= 1
+        
+        limit = min(opened[i] + 1, num_classes)
+        c += 1
+        while c < limit and not (counts[c] < q or (counts[c] == q and full < r)):
+            c += 1
+        if c >= limit:
+            labels[i] = -1
+            i -= 1
+            continue
+        
+        labels[i] = c
+        counts[c] += 1
+        if counts[c] == q + 1:
+            full += 1
+        
+        if i == depth - 1:
+            yield tuple(labels)
+        else:
+            opened[i + 1] = max(opened[i], c + 1)
+            i += 1
+
+
+def _select_top(entries: List[Tuple[Tuple[int, ...], int]], more_than_top: bool,
+                top: int = 5) -> List[Tuple[Tuple[int, ...], int]]:
+    """
+    Κανόνας επιλογής του Κανόνα 2 πάνω σε υποψήφια (labels, broken).
+    
+    Με >top έγκυρα σενάρια: αν υπάρχουν σενάρια χωρίς σπασμένες φιλίες κρατιούνται
+    μόνο αυτά, αλλιώς ταξινόμηση κατά σπασμένες φιλίες· στην ισοπαλία προηγείται
+    η σειρά παραγωγής (= λεξικογραφική σειρά των labels). Με ≤top έγκυρα σενάρια
+    επιστρέφονται όλα με τη σειρά παραγωγής.
+    """
+    if not more_than_top:
+        return sorted(entries)
+    ranked = sorted(entries, key=lambda e: (e[1], e[0]))
+    if ranked and ranked[0][1] == 0:
+        ranked = [e for e in ranked if e[1] == 0]
+    return ranked[:top]
+
+
+def _block_width(n: int, num_classes: int) -> int:
+    """Πλήθος τελευταίων παιδιών που απαριθμούνται ως ένα μπλοκ NumPy (≤ _BLOCK_ROWS γραμμές)"""
+    return min(n, max(1, int(math.log(_BLOCK_ROWS) / math.log(num_classes))))
+
+
+def _exhaustive_top(n: int, num_classes: int, edges: List[Tuple[int, int]], top: int = 5,
+                    prefixes: Sequence[Tuple[int, ...]] = ((),),
+                    budget: Optional[_SearchBudget] = None) -> Tuple[List[Tuple[Tuple[int, ...], int]], int, int]:
+    """
+    Εξαντλητική αξιολόγηση όλων των ισόρροπων canonical κατανομών σε μπλοκ NumPy.
+    
+    Τα τελευταία t παιδιά απαριθμούνται μία φορά ως πίνακας int8 (num_classes**t
+    γραμμές, έως _BLOCK_ROWS), μαζί με τα πλήθη ανά τμήμα και τις εσωτερικές
+    σπασμένες φιλίες τους. Για κάθε έγκυρο πρόθεμα των πρώτων n-t παιδιών, ο
+    έλεγχος canonical μορφής, ο έλεγχος ισοκατανομής και η μέτρηση σπασμένων
+    φιλιών (πίνακες άκρων u, v) γίνονται ως reductions πάνω σε όλο το μπλοκ.
+    Με `prefixes` (μήκους ≤ n-t, σε λεξικογραφική σειρά) εξετάζονται μόνο οι
+    κατανομές που ξεκινούν με ένα από αυτά. Με `budget` ελέγχεται το όριο μετά
+    από κάθε μπλοκ.
+    
+    Returns:
+        (τα top καλύτερα κατά (broken, σειρά) ως (labels, broken),
+         πλήθος έγκυρων, πλήθος χωρίς σπασμένες φιλίες)
+    """
+    if n < 2 or num_classes < 2:
+        return [], 0, 0
+    t = _block_width(n, num_classes)
+    p = n - t
+    u = np.array([min(a, b) for a, b in edges if a != b], dtype=np.intp)
+    v = np.array([max(a, b) for a, b in edges if a != b], dtype=np.intp)
+    inner_p = v < p                      # και τα δύο άκρα στο πρόθεμα
+    cross = (u < p) & (v >= p)           # ένα άκρο στο πρόθεμα, ένα στο μπλοκ
+    inner_s = u >= p                     # και τα δύο άκρα στο μπλοκ
+    
+    # Μπλοκ των τελευταίων t παιδιών με τη σειρά του itertools.product
+    rows = num_classes ** t
+    powers = num_classes ** np.arange(t - 1, -1, -1, dtype=np.int64)
+    block = ((np.arange(rows, dtype=np.int64)[:, None] // powers) % num_classes).astype(np.int8)
+    block_counts = np.stack([(block == c).sum(axis=1) for c in range(num_classes)], axis=1)
+    # Λίγα διαφορετικά διανύσματα πλήθους: ο έλεγχος ισοκατανομής γίνεται πάνω σε αυτά
+    shapes, shape_of_row = np.unique(block_counts, axis=0, return_inverse=True)
+    shape_of_row = shape_of_row.reshape(-1)
+    block_broken = (block[:, u[inner_s] - p] != block[:, v[inner_s] - p]).sum(axis=1)
+    # Canonical μορφή: κάθε παιδί ανοίγει το πολύ το επόμενο τμήμα μετά τα ήδη ανοιχτά
+    prev_max = np.concatenate([np.full((rows, 1), -1, dtype=np.int8),
+                               np.maximum.accumulate(block, axis=1)[:, :-1]], axis=1)
+    canonical_for = [(block <= np.maximum(prev_max, opened - 1) + 1).all(axis=1)
+                     for opened in range(num_classes + 1)]
+    
+    best_labels = np.empty((0, n), dtype=np.int8)
+    best_broken = np.empty(0, dtype=np.int64)
+    valid_count = 0
+    zero_count = 0
+    # Οι έγκυρες γραμμές του μπλοκ εξαρτώνται μόνο από (ανοιχτά τμήματα, πλήθη) του προθέματος
+    selections: Dict[Tuple[int, ...], Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+    heads = itertools.chain.from_iterable(
+        _balanced_partitions(n, num_classes, depth=p, prefix=prefix) for prefix in prefixes)
+    for head in heads:
+        head_arr = np.array(head, dtype=np.int8)
+        opened = int(head_arr.max()) + 1 if p else 0
+        head_counts = np.bincount(head_arr, minlength=num_classes)
+        key = (opened,) + tuple(int(c) for c in head_counts)
+        if key not in selections:
+            counts = shapes + head_counts
+            shape_ok = counts.max(axis=1) - counts.min(axis=1) <= 1
+            sel = np.flatnonzero(canonical_for[opened] & shape_ok[shape_of_row])
+            selections[key] = (sel, block[sel], block_broken[sel])
+        sel, sel_block, sel_broken = selections[key]
+        if not len(sel):
+            continue
+        broken = (sel_broken
+                  + int((head_arr[u[inner_p]] != head_arr[v[inner_p]]).sum())
+                  + (sel_block[:, v[cross] - p] != head_arr[u[cross]]).sum(axis=1))
+        valid_count += len(sel)
+        zero_count += int((broken == 0).sum())
+        
+        # Συγχώνευση με τα μέχρι τώρα top (stable: τα παλαιότερα προηγούνται στην ισοπαλία)
+        labels = np.empty((len(sel), n), dtype=np.int8)
+        labels[:, :p] = head_arr
+        labels[:, p:] = sel_block
+        cand_broken = np.concatenate([best_broken, broken])
+        keep = np.argsort(cand_broken, kind="stable")[:top]
+        best_labels = np.concatenate([best_labels, labels])[keep]
+        best_broken = cand_broken[keep]
+        if budget is not None and budget.charge(len(sel), int(best_broken[0])):
+            break
+    
+    best = [(tuple(int(c) for c in row), int(b)) for row, b in zip(best_labels, best_broken)]
+    return best, valid_count, zero_count
+
+
+def _earlier_neighbours(n: int, edges: List[Tuple[int, int]]) -> List[List[int]]:
+    """Για κάθε παιδί i, οι φίλοι του με μικρότερο δείκτη (ήδη τοποθετημένοι στο DFS)"""
+    earlier = [[] for _ in range(n)]
+    for a, b in edges:
+        if a != b:
+            earlier[max(a, b)].append(min(a, b))
+    return earlier
+
+
+def _branch_and_bound_top(n: int, num_classes: int, edges: List[Tuple[int, int]], top: int = 5,
+                          prefixes: Sequence[Tuple[int, ...]] = ((),),
+                          budget: Optional[_SearchBudget] = None) -> Tuple[List[Tuple[Tuple[int, ...], int]], int, bool]:
+    """
+    Τοποθετεί τα παιδιά ένα-ένα (ίδια σειρά με το _balanced_partitions) και κρατά
+    heap `top` θέσεων με κλειδί (σπασμένες φιλίες, σειρά εύρεσης).
+    
+    Ένας κλάδος κόβεται όταν οι ήδη σπασμένες φιλίες του δεν είναι μικρότερες από
+    το χειρότερο σενάριο του heap: κάθε μεταγενέστερο φύλλο χάνει και στην ισοπαλία.
+    Με `top` σενάρια χωρίς σπασμένες φιλίες η αναζήτηση σταματά αμέσως.
+    Με `prefixes` (σε λεξικογραφική σειρά) εξετάζονται μόνο οι κατανομές που
+    ξεκινούν με ένα από αυτά, με κοινό heap. Με `budget` ελέγχεται το όριο σε
+    κάθε φύλλο και ανά _BUDGET_CHECK_STEPS βήματα του DFS.
+    
+    Returns:
+        (heap ως (labels, broken), πλήθος φύλλων που εξετάστηκαν, αν έγινε κλάδεμα)
+        Κάθε κομμένος κλάδος περιέχει τουλάχιστον ένα έγκυρο σενάριο, άρα υπάρχουν
+        >top έγκυρα σενάρια ακριβώς όταν φύλλα > top ή έγινε κλάδεμα.
+    """
+    if n < 2 or num_classes < 2:
+        return [], 0, False
+    q, r = divmod(n, num_classes)
+    earlier = _earlier_neighbours(n, edges)
+    heap = []  # (-broken, -σειρά, labels): στην κορυφή το χειρότερο σενάριο
+    leaves = 0
+    pruned = False
+    steps = 0
+    
+    for prefix in prefixes:
+        if len(heap) == top and heap[0][0] == 0:
+            pruned = True  # top σενάρια χωρίς σπασμένες φιλίες - τίποτα δεν τα ξεπερνά
+            break
+        if budget is not None and budget.exhausted:
+            break
+        start = len(prefix)
+        counts = [0] * num_classes
+        labels = list(prefix) + [-1] * (n - start)
+        opened = [0] * (n + 1)
+        broken = [0] * (n + 1)  # broken[i] = σπασμένες φιλίες μεταξύ των πρώτων i παιδιών
+        for i, c in enumerate(prefix):
+            counts[c] += 1
+            broken[start] += sum(1 for j in earlier[i] if labels[j] != c)
+        full = sum(1 for c in counts if c == q + 1)
+        opened[start] = max(prefix) + 1 if prefix else 0
+        
+        i = start
+        while i >= start:
+            steps += 1
+            if budget is not None and steps % _BUDGET_CHECK_STEPS == 0 and \
+                    budget.charge(0, min(-e[0] for e in heap) if heap else None):
+                break
+            c = labels[i]
+            if c >= 0:
+                if counts[c] == q + 1:
+                    full -= 1
+                counts[c] -= 1
+            
+            limit = min(opened[i] + 1, num_classes)
+            c += 1
+            b = 0
+            while c < limit:
+                if counts[c] < q or (counts[c] == q and full < r):
+                    b = broken[i] + sum(1 for j in earlier[i] if labels[j] != c)
+                    if len(heap) < top or b < -heap[0][0]:
+                        break
+                    pruned = True
+                c += 1
+            if c >= limit:
+                labels[i] = -1
+                i -= 1
+                continue
+            
+            labels[i] = c
+            counts[c] += 1
+            if counts[c] == q + 1:
+                full += 1
+            
+            if i == n - 1:
+                leaves += 1
+                entry = (-b, -leaves, tuple(labels))
+                if len(heap) < top:
+                    heapq.heappush(heap, entry)
+                else:
+                    heapq.heapreplace(heap, entry)
+                if len(heap) == top and heap[0][0] == 0:
+                    pruned = True  # top σενάρια χωρίς σπασμένες φιλίες - τίποτα δεν τα ξεπερνά
+                    break
+                if budget is not None and budget.charge(1, min(-e[0] for e in heap)):
+                    break
+            else:
+                broken[i + 1] = b
+                opened[i + 1] = max(opened[i], c + 1)
+                i += 1
+    
+    return [(e[2], -e[0]) for e in heap], leaves, pruned
+
+
+def _search_shard(search: str, n: int, num_classes: int, edges: List[Tuple[int, int]],
+                  prefixes: Sequence[Tuple[int, ...]],
+                  budget: Optional[_SearchBudget] = None) -> Tuple[List[Tuple[Tuple[int, ...], int]], int, int, bool, bool]:
+    """
+    Αναζήτηση σε ένα shard (κατανομές με δοσμένα προθέματα) - εκτελείται και σε process pool.
+    
+    Returns:
+        (τοπικά top ως (labels, broken), πλήθος σεναρίων που εξετάστηκαν,
+         πλήθος χωρίς σπασμένες φιλίες (μόνο exhaustive), αν έγινε κλάδεμα,
+         αν η αναζήτηση διακόπηκε από το budget)
+    """
+    if budget is not None and budget.deadline is None:
+        budget.start()
+    if search == "bnb":
+        entries, leaves, pruned = _branch_and_bound_top(n, num_classes, edges, prefixes=prefixes, budget=budget)
+        zero_count, examined = sum(1 for _, b in entries if b == 0), leaves
+    else:
+        entries, examined, zero_count = _exhaustive_top(n, num_classes, edges, prefixes=prefixes, budget=budget)
+        pruned = False
+    return entries, examined, zero_count, pruned, budget is not None and budget.exhausted
+
+
+def _shard_prefixes(n: int, num_classes: int, workers: int,
+                    max_depth: int) -> List[List[Tuple[int, ...]]]:
+    """
+    Τα shards: έγκυρα προθέματα (τμήμα των πρώτων παιδιών), τουλάχιστον 4 ανά
+    worker, μοιρασμένα εκ περιτροπής ώστε κάθε shard να έχει παρόμοιο φόρτο.
+    """
+    prefixes = [()]
+    for depth in range(1, max_depth + 1):
+        prefixes = list(_balanced_partitions(n, num_classes, depth=depth))
+        if len(prefixes) >= 4 * workers:
+            break
+    return [shard for shard in (prefixes[w::workers] for w in range(workers)) if shard]
+
+
+def _run_search(search: str, n: int, num_classes: int, edges: List[Tuple[int, int]],
+                workers: Optional[int] = None,
+                budget: Optional[_SearchBudget] = None) -> Tuple[List[Tuple[Tuple[int, ...], int]], int, int, bool]:
+    """
+    Εκτελεί την αναζήτηση σε μία διεργασία ή (workers > 1) σε process pool.
+    
+    Ο χώρος αναζήτησης μοιράζεται κατά τμήμα των πρώτων παιδιών. Κάθε shard
+    επιστρέφει τα τοπικά του top και τα πλήθη του, και η συγχώνευση γίνεται με
+    το ντετερμινιστικό κλειδί (broken, labels) του _select_top, οπότε το
+    αποτέλεσμα είναι ίδιο με την εκτέλεση σε μία διεργασία.
+    
+    Με budget, κάθε shard παίρνει τον υπόλοιπο χρόνο και ίσο μερίδιο του
+    max_candidates· η πρόοδος αναφέρεται καθώς ολοκληρώνονται τα shards. Το ρολόι
+    κάθε shard ξεκινά όταν αρχίσει ο worker, ώστε η εκκίνηση των διεργασιών να μην
+    τρώει τον χρόνο αναζήτησης (ο συνολικός χρόνος μπορεί να την υπερβεί λίγο).
+    """
+    shards = [[()]]
+    if workers and workers > 1:
+        max_depth = n - 1 if search == "bnb" else n - _block_width(n, num_classes)
+        shards = _shard_prefixes(n, num_classes, workers, max_depth)
+    if len(shards) <= 1:
+        entries, examined, zero_count, pruned, _ = _search_shard(search, n, num_classes, edges, [()], budget)
+        return entries, examined, zero_count, pruned
+    
+    shard_budgets = itertools.repeat(None)
+    if budget is not None:
+        per_shard = None if budget.max_candidates is None else -(-budget.max_candidates // len(shards))
+        shard_budgets = [_SearchBudget(budget.remaining_seconds(), per_shard, start=False) for _ in shards]
+    
+    print(f"Παράλληλη αναζήτηση: {sum(len(s) for s in shards)} προθέματα σε {len(shards)} διεργασίες")
+    results = []
+    with ProcessPoolExecutor(max_workers=len(shards)) as pool:
+        for res in pool.map(_search_shard, itertools.repeat(search), itertools.repeat(n),
+                            itertools.repeat(num_classes), itertools.repeat(edges), shards, shard_budgets):
+            results.append(res)
+            if budget is not None:
+                budget.charge(res[1], min((b for res in results for _, b in res[0]), default=None))
+    
+    entries = [e for shard_entries, *_ in results for e in shard_entries]
+    examined = sum(res[1] for res in results)
+    zero_count = sum(res[2] for res in results)
+    pruned = any(res[3] for res in results)
+    if budget is not None:
+        budget.exhausted = any(res[4] for res in results)
+    return entries, examined, zero_count, pruned
+
+
+def _friendship_components(n: int, edges: List[Tuple[int, int]]) -> List[List[int]]:
+    """Συνεκτικές συνιστώσες του γράφου φιλιών (με σειρά μικρότερου δείκτη)"""
+    parent = list(range(n))
+    
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    
+    for a, b in edges:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    
+    groups: Dict[int, List[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def _bfs_order(members: List[int], edges: List[Tuple[int, int]]) -> List[int]:
+    """Τα μέλη μιας συνιστώσας σε σειρά BFS, ώστε οι φίλοι να τοποθετούνται διαδοχικά"""
+    inside = set(members)
+    neighbours: Dict[int, List[int]] = {kid: [] for kid in members}
+    for a, b in edges:
+        if a in inside:
+            neighbours[a].append(b)
+            neighbours[b].append(a)
+    order = [members[0]]
+    seen = {members[0]}
+    for kid in order:
+        for other in sorted(neighbours[kid]):
+            if other not in seen:
+                seen.add(other)
+                order.append(other)
+    return order
+
+
+def _component_partitions(members: List[int], edges: List[Tuple[int, int]], num_classes: int,
+                          cap: int, limit: Optional[int] = None,
+                          budget: Optional[_SearchBudget] = None) -> List[Tuple[int, Tuple[int, ...]]]:
+    """
+    Διαμερίσεις μιας συνιστώσας σε ≤num_classes ομάδες μεγέθους ≤cap, ως
+    (σπασμένες φιλίες, labels σε μορφή restricted growth string), ταξινομημένες.
+    
+    Με limit=None επιστρέφονται μόνο οι βέλτιστες (ελάχιστο πλήθος σπασμένων
+    φιλιών), αλλιώς όσες σπάνε ≤limit φιλίες. Κλαδεύεται κάθε μερική ανάθεση που
+    ξεπερνά το όριο, ώστε μεγάλες συνιστώσες να μην απαριθμούνται ολόκληρες.
+    Αν εξαντληθεί το `budget`, επιστρέφονται όσες βρέθηκαν ως εκείνη τη στιγμή.
+    """
+    local = {kid: i for i, kid in enumerate(members)}
+    earlier = _earlier_neighbours(len(members), [(local[a], local[b]) for a, b in edges if a in local])
+    options = []
+    labels: List[int] = []
+    sizes: List[int] = []
+    bound = math.inf if limit is None else limit
+    steps = 0
+    
+    def stopped() -> bool:
+        nonlocal steps
+        if budget is None:
+            return False
+        steps += 1
+        return budget.exhausted or (steps % _BUDGET_CHECK_STEPS == 0 and budget.charge(0))
+    
+    def extend(i: int, broken: int):
+        nonlocal bound
+        if broken > bound or stopped():
+            return
+        if i == len(members):
+            if limit is None and broken < bound:
+                bound = broken
+                options.clear()
+            options.append((broken, tuple(labels)))
+            return
+        for c in range(min(len(sizes) + 1, num_classes)):
+            if c == len(sizes):
+                sizes.append(0)
+            if sizes[c] < cap:
+                sizes[c] += 1
+                labels.append(c)
+                extend(i + 1, broken + sum(1 for j in earlier[i] if labels[j] != c))
+                labels.pop()
+                sizes[c] -= 1
+            if sizes[c] == 0:
+                sizes.pop()
+    
+    extend(0, 0)
+    options.sort()
+    return options
+
+
+def _component_top(n: int, num_classes: int, edges: List[Tuple[int, int]], top: int = 5,
+                   budget: Optional[_SearchBudget] = None) -> Tuple[List[Tuple[Tuple[int, ...], int]], int, bool]:
+    """
+    Top σενάρια με αποσύνθεση σε συνιστώσες φιλιών.
+    
+    Κάθε συνιστώσα λύνεται χωριστά και οι συνιστώσες συνδυάζονται με
+    branch-and-bound, όπου το κάτω φράγμα είναι το άθροισμα των ελαχίστων των
+    συνιστωσών που απομένουν. Οι ομάδες κάθε διαμέρισης μπαίνουν σε τμήματα με
+    canonical σειρά ανοίγματος ώστε κάθε κατανομή να παράγεται μία φορά. Τα
+    μεμονωμένα παιδιά συμπληρώνουν ακριβώς τα κενά ως το q / q+1 και δεν σπάνε φιλίες.
+    
+    Από κάθε συνιστώσα απαριθμούνται μόνο οι διαμερίσεις με ≤ ελάχιστο + slack
+    σπασμένες φιλίες. Το slack αυξάνεται ώσπου το heap να γεμίσει με χειρότερο
+    σενάριο ≤ Σελαχίστων + slack (τότε κάθε σενάριο που παραλείφθηκε σπάει
+    περισσότερες φιλίες) ή ώσπου να καλύπτονται όλες οι διαμερίσεις.
+    
+    Κρατά heap top+1 θέσεων: αν βρεθούν ≤top σενάρια δεν έγινε κανένα κλάδεμα,
+    άρα εφαρμόζεται ακριβώς ο ίδιος κανόνας επιλογής με την εξαντλητική.
+    Με `budget` ελέγχεται το όριο σε κάθε φύλλο και ανά _BUDGET_CHECK_STEPS βήματα.
+    
+    Returns:
+        (σενάρια ως (labels, broken), πλήθος φύλλων που εξετάστηκαν, αν έγινε κλάδεμα)
+    """
+    if n < 2 or num_classes < 2:
+        return [], 0, False
+    q, r = divmod(n, num_classes)
+    cap = q + 1 if r else q
+    components = _friendship_components(n, edges)
+    groups = [_bfs_order(c, edges) for c in sorted((c for c in components if len(c) > 1), key=len, reverse=True)]
+    isolated = [c[0] for c in components if len(c) == 1]
+    best_options = [_component_partitions(g, edges, num_classes, cap, budget=budget) for g in groups]
+    mins = [opts[0][0] if opts else 0 for opts in best_options]
+    inside = [set(g) for g in groups]
+    # Με slack ≥ πλήθος ακμών της συνιστώσας έχουν απαριθμηθεί όλες οι διαμερίσεις της
+    max_slack = max((sum(1 for a, _ in edges if a in s) for s in inside), default=0)
+    
+    keep = top + 1
+    heap = []  # (-broken, -σειρά, labels): στην κορυφή το χειρότερο σενάριο
+    counts = [0] * num_classes
+    labels = [-1] * n
+    full = 0
+    opened = 0
+    leaves = 0
+    pruned = False
+    steps = 0
+    options = best_options
+    rest_min = [0] * (len(groups) + 1)
+    
+    def best_broken() -> Optional[int]:
+        return min(-e[0] for e in heap) if heap else None
+    
+    def cut(bound: int) -> bool:
+        nonlocal pruned, steps
+        if budget is not None:
+            steps += 1
+            if budget.exhausted or (steps % _BUDGET_CHECK_STEPS == 0 and budget.charge(0, best_broken())):
+                return True
+        if len(heap) == keep and bound >= -heap[0][0]:
+            pruned = True
+            return True
+        return False
+    
+    def fill_isolated(t: int, broken: int):
+        nonlocal full, opened, leaves
+        if cut(broken):
+            return
+        if t == len(isolated):
+            leaves += 1
+            entry = (-broken, -leaves, tuple(labels))
+            if len(heap) < keep:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heapreplace(heap, entry)
+            if budget is not None:
+                budget.charge(1, best_broken())
+            return
+        kid = isolated[t]
+        for c in range(min(opened + 1, num_classes)):
+            if counts[c] < q or (counts[c] == q and full < r):
+                was_opened = opened
+                counts[c] += 1
+                full += counts[c] == q + 1
+                opened = max(opened, c + 1)
+                labels[kid] = c
+                fill_isolated(t + 1, broken)
+                full -= counts[c] == q + 1
+                counts[c] -= 1
+                opened = was_opened
+                if cut(broken):
+                    return
+    
+    def assign_blocks(g: int, blocks: List[List[int]], bi: int, used: Set[int], broken: int):
+        nonlocal full, opened
+        if bi == len(blocks):
+            place_group(g + 1, broken)
+            return
+        block = blocks[bi]
+        for c in range(min(opened + 1, num_classes)):
+            new_count = counts[c] + len(block)
+            if c in used or new_count > q + 1 or (new_count == q + 1 and full >= r):
+                continue
+            was_opened = opened
+            counts[c] = new_count
+            full += new_count == q + 1
+            opened = max(opened, c + 1)
+            used.add(c)
+            for kid in block:
+                labels[kid] = c
+            assign_blocks(g, blocks, bi + 1, used, broken)
+            used.discard(c)
+            full -= new_count == q + 1
+            counts[c] -= len(block)
+            opened = was_opened
+            if cut(broken + rest_min[g + 1]):
+                return
+    
+    def place_group(g: int, broken: int):
+        if cut(broken + rest_min[g]):
+            return
+        if g == len(groups):
+            fill_isolated(0, broken)
+            return
+        members = groups[g]
+        for part_broken, part_labels in options[g]:
+            if cut(broken + part_broken + rest_min[g + 1]):
+                break  # οι επόμενες διαμερίσεις σπάνε ακόμη περισσότερες φιλίες
+            blocks = [[] for _ in range(max(part_labels) + 1)]
+            for kid, c in zip(members, part_labels):
+                blocks[c].append(kid)
+            assign_blocks(g, blocks, 0, set(), broken + part_broken)
+    
+    slack = 0
+    while True:
+        if slack:
+            options = [_component_partitions(g, edges, num_classes, cap, m + slack, budget)
+                       for g, m in zip(groups, mins)]
+        # rest_min[g] = κάτω φράγμα για τις συνιστώσες g, g+1, ...
+        for g in range(len(groups) - 1, -1, -1):
+            rest_min[g] = rest_min[g + 1] + mins[g]
+        heap.clear()
+        leaves, pruned, steps = 0, False, 0
+        place_group(0, 0)
+    
+        complete = slack >= max_slack
+        if complete or (budget is not None and budget.exhausted):
+            break
+        if len(heap) == keep:
+            worst = -heap[0][0]
+            if worst <= sum(mins) + slack:
+                pruned = True  # παραλείφθηκαν μόνο σενάρια χειρότερα από το heap
+                break
+            slack = min(worst - sum(mins), max_slack)
+        else:
+            slack = min(max(1, 2 * slack), max_slack)
+    
+    def canonical(assignment: Tuple[int, ...]) -> Tuple[int, ...]:
+        relabel: Dict[int, int] = {}
+        return tuple(relabel.setdefault(c, len(relabel)) for c in assignment)
+    
+    # Με ≤top σενάρια βρέθηκαν όλα τα έγκυρα: ίδια (λεξικογραφική) σειρά με την εξαντλητική
+    more_than_top = len(heap) > top or (budget is not None and budget.exhausted)
+    best = _select_top([(canonical(e[2]), -e[0]) for e in heap], more_than_top, top)
+    return best, leaves, pruned
+
+
+# === CACHE ΣΕΝΑΡΙΩΝ ===
+
+def _cache_key(teacher_kids: List[str], friendships: FrozenSet[Tuple[str, str]],
+               num_classes: int, search: str) -> str:
+    """
+    Σταθερό sha256 των εισόδων του Βήματος 1.
+    
+    Τα παιδιά εκπαιδευτικών μπαίνουν με τη σειρά του roster: η σειρά καθορίζει
+    ποιο από ισοβαθμούντα σενάρια επιλέγεται, άρα και το αποτέλεσμα.
+    """
+    payload = {
+        "teacher_kids": list(teacher_kids),
+        "friendships": sorted(list(pair) for pair in friendships),
+        "num_classes": int(num_classes),
+        "search": search,
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _results_to_json(results: Step1Results) -> dict:
+    """Σειριοποίηση Step1Results σε JSON-συμβατό dict"""
+    return {
+        "scenarios": [
+            {
+                "id": s.id,
+                "column_name": s.column_name,
+                "assignments": s.assignments,
+                "description": s.description,
+                "broken_friendships": s.broken_friendships,
+                "metadata": s.metadata,
+            }
+            for s in results.scenarios
+        ],
+        "friendships": sorted(list(pair) for pair in results.friendships),
+        "teacher_kids": list(results.teacher_kids),
+        "num_classes": results.num_classes,
+        "creation_timestamp": results.creation_timestamp,
+    }
+
+
+def _results_from_json(data: dict) -> Step1Results:
+    """Ανασύνθεση Step1Results από το dict της _results_to_json"""
+    return Step1Results(
+        scenarios=tuple(Step1Scenario(**s) for s in data["scenarios"]),
+        friendships=frozenset(tuple(pair) for pair in data["friendships"]),
+        teacher_kids=tuple(data["teacher_kids"]),
+        num_classes=data["num_classes"],
+        creation_timestamp=data["creation_timestamp"],
+    )
+
+
+def _load_cached_results(cache_dir: str, key: str) -> Optional[Step1Results]:
+    """Φόρτωση από cache (None αν λείπει ή είναι κατεστραμμένο)· ανανεώνει το mtime για LRU"""
+    path = Path(cache_dir) / f"{_CACHE_PREFIX}{key}.json"
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            results = _results_from_json(json.load(f))
+        os.utime(path)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return results
+
+
+def _store_cached_results(cache_dir: str, key: str, results: Step1Results,
+                          max_entries: int = _CACHE_MAX_ENTRIES):
+    """Αποθήκευση στο cache και διαγραφή των λιγότερο πρόσφατα χρησιμοποιημένων πέρα από max_entries"""
+    directory = Path(cache_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{_CACHE_PREFIX}{key}.json"
+    # Μοναδικό προσωρινό αρχείο ανά εγγραφή, ώστε ταυτόχρονες διεργασίες να μη γράφουν στο ίδιο
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, prefix=path.name + ".",
+                                     suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+        try:
+            json.dump(_results_to_json(results), f, ensure_ascii=False)
+        except BaseException:
+            f.close()
+            os.unlink(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+    
+    def mtime(entry: Path) -> float:
+        try:
+            return entry.stat().st_mtime
+        except OSError:
+            return 0.0
+    
+    # Μόνο αρχεία του cache: άλλα .json στον ίδιο φάκελο δεν αγγίζονται
+    entries = sorted(directory.glob(f"{_CACHE_PREFIX}*.json"), key=mtime, reverse=True)
+    for stale in entries[max(max_entries, 1):]:
+        try:
+            stale.unlink()
+        except OSError:
+            pass
 
 
 # === UTILITY FUNCTIONS ===
 
-def create_immutable_step1(df: pd.DataFrame, num_classes: Optional[int] = None) -> Tuple[pd.DataFrame, Step1Results]:
+def create_immutable_step1(df: pd.DataFrame, num_classes: Optional[int] = None,
+                           search: str = "exhaustive",
+                           workers: Optional[int] = None,
+                           budget_seconds: Optional[float] = None,
+                           max_candidates: Optional[int] = None,
+                           progress: Optional[Callable[[int, Optional[int]], None]] = None,
+                           cache_dir: Optional[str] = None,
+                           cache_max_entries: int = _CACHE_MAX_ENTRIES
+                           ) -> Tuple[pd.DataFrame, Step1Results]:
     """
     Δημιουργεί immutable αποτελέσματα βήματος 1.
     
     Args:
         df: Αρχικό DataFrame με δεδομένα μαθητών
         num_classes: Αριθμός τμημάτων (αν None, αυτόματος υπολογισμός)
+        search: "exhaustive" (όλα τα έγκυρα σενάρια), "bnb" (branch-and-bound,
+            ίδια 5 σενάρια με μνήμη O(5)) ή "components" (ανά συνιστώσα φιλιών,
+            ίδιες σπασμένες φιλίες με κόστος που εξαρτάται από τη μεγαλύτερη συνιστώσα)
+        workers: Αν >1, τα "exhaustive"/"bnb" μοιράζονται σε τόσες διεργασίες
+            (ίδιο αποτέλεσμα με την εκτέλεση σε μία διεργασία)
+        budget_seconds: Χρονικό όριο αναζήτησης· όταν λήξει επιστρέφονται τα
+            καλύτερα σενάρια ως τώρα με metadata["search_truncated"] = True.
+            Με workers >1 κάθε shard έχει δικό του όριο (από την εκκίνηση του worker)
+            και κλαδεύει μόνο με τα δικά του σενάρια, οπότε με στενό όριο μπορεί να
+            επιστραφούν χειρότερα σενάρια από ό,τι με workers=1
+        max_candidates: Μέγιστο πλήθος υποψήφιων σεναρίων προς αξιολόγηση
+        progress: callback(εξετασμένα υποψήφια, καλύτερες σπασμένες φιλίες ως τώρα)
+        cache_dir: Φάκελος cache· αν υπάρχουν ήδη σενάρια για τα ίδια παιδιά
+            εκπαιδευτικών, φιλίες, τμήματα και search, φορτώνονται χωρίς αναζήτηση
+        cache_max_entries: Μέγιστο πλήθος αποτελεσμάτων στο cache (διαγράφονται
+            τα λιγότερο πρόσφατα χρησιμοποιημένα)
     
     Returns:
         (DataFrame με στήλες ΒΗΜΑ1_ΣΕΝΑΡΙΟ_X, Step1Results object)
     """
     processor = Step1ImmutableProcessor()
-    results = processor.create_scenarios(df, num_classes)
+    results = processor.create_scenarios(df, num_classes, search=search, workers=workers,
+                                         budget_seconds=budget_seconds, max_candidates=max_candidates,
+                                         progress=progress, cache_dir=cache_dir,
+                                         cache_max_entries=cache_max_entries)
     updated_df = processor.apply_to_dataframe(df)
     
     return updated_df, results
@@ -569,50 +1496,47 @@ def _col_letter_to_index_strict(letter: str) -> int:
             v = v * 26 + (ord(ch) - ord("A") + 1)
     return max(0, v - 1)
 
-def _reorder_with_padding(df: pd.DataFrame, scen_col: str, target_letter: str,
-                          base_columns: list = None, pad_prefix: str = "__PAD_K") -> pd.DataFrame:
-    """Επιστρέφει νέο DataFrame όπου η στήλη σεναρίου είναι ΑΥΣΤΗΡΑ στη target_letter.
-Προσθέτει κενές στήλες padding αν χρειαστεί ώστε να υπάρχει πάντα η target_letter."""
+def _strict_column_layout(columns: list, scen_col: str, target_letter: str,
+                          base_columns: list = None, pad_prefix: str = "__PAD_K") -> Tuple[list, list]:
+    """Σειρά στηλών όπου η στήλη σεναρίου είναι ΑΥΣΤΗΡΑ στη target_letter, χωρίς αντιγραφή δεδομένων.
+Επιστρέφει (σειρά στηλών, ονόματα στηλών padding που πρέπει να προστεθούν κενές)."""
     if base_columns is None:
         base_columns = ['ΟΝΟΜΑ','ΦΥΛΟ','ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ','ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ']
 
-    df = df.copy()
+    columns = list(columns)
     # Συγκεντρώνουμε όλες τις στήλες σεναρίων για να αφαιρέσουμε τις υπόλοιπες
-    scenario_cols_all = [c for c in df.columns if str(c).startswith("ΒΗΜΑ1_ΣΕΝΑΡΙΟ_")]
-    base_cols_present = [c for c in base_columns if c in df.columns]
-    non_scen = [c for c in df.columns if c not in scenario_cols_all]
+    scenario_cols_all = [c for c in columns if str(c).startswith("ΒΗΜΑ1_ΣΕΝΑΡΙΟ_")]
+    base_cols_present = [c for c in base_columns if c in columns]
+    non_scen = [c for c in columns if c not in scenario_cols_all]
     remainder = [c for c in non_scen if c not in base_cols_present]
 
     ordered = base_cols_present + [c for c in remainder if c != scen_col]
 
     target_idx = _col_letter_to_index_strict(target_letter)
     # Padding μέχρι να υπάρχει τουλάχιστον target_idx θέσεις πριν την εισαγωγή
-    pad_count = 0
+    pads = []
     while len(ordered) < target_idx:
-        pad_count += 1
-        pad_name = f"{pad_prefix}{pad_count:02d}"
-        while pad_name in df.columns or pad_name in ordered:
+        pad_name = f"{pad_prefix}{len(pads) + 1:02d}"
+        while pad_name in columns or pad_name in ordered:
             pad_name += "_"
-        df[pad_name] = ""
+        pads.append(pad_name)
         ordered.append(pad_name)
 
     # Εισαγωγή στήλης σεναρίου ακριβώς στη θέση target_idx
     insert_idx = min(max(0, target_idx), len(ordered))
     ordered.insert(insert_idx, scen_col)
+    return ordered, pads
+
+def _write_sheet_strict(workbook, sheet_name: str, df: pd.DataFrame, columns: list,
+                        hidden: Sequence = (), header_format=None):
+    """
+    Γράφει τις `columns` του df σε νέο φύλλο (write_sheet_rows). Στήλες που δεν
+    υπάρχουν στο df (padding) γράφονται μόνο ως header και όσες είναι στο
+    `hidden` κρύβονται ήδη κατά την εγγραφή - χωρίς αντίγραφα του df.
+    """
+    layout = [(name, df[name] if name in df.columns else None) for name in columns]
+    return write_sheet_rows(workbook, sheet_name, layout, header_format, hidden)
 
-    return df[ordered]
-
-def _hide_padding_columns(xlsx_path: str, pad_prefix: str = "__PAD_K"):
-    """Κρύβει στο Excel όσες στήλες έχουν header που ξεκινά με pad_prefix."""
-    from openpyxl import load_workbook
-    from openpyxl.utils import get_column_letter
-    wb = load_workbook(xlsx_path)
-    for ws in wb.worksheets:
-        headers = [cell.value if cell.value is not None else "" for cell in ws[1]]
-        for idx, name in enumerate(headers, start=1):
-            if isinstance(name, str) and name.startswith(pad_prefix):
-                ws.column_dimensions[get_column_letter(idx)].hidden = True
-    wb.save(xlsx_path)
 # === NEW (v2): Save Step-1 results with one sheet per scenario and place the scenario column at a target Excel letter ===
 def save_immutable_step1_results_separate(df_with_step1: pd.DataFrame, results: Step1Results,
                                           output_file: str = "ΒΗΜΑ1_IMΜUTABLE_PER_ΣΕΝΑΡΙΟ.xlsx",
@@ -749,19 +1673,21 @@ def save_immutable_step1_results_separate_STRICT(df_with_step1: pd.DataFrame, re
         })
     summary_df = pd.DataFrame(summary_rows)
 
-    tmp_out = output_file + (".tmp.xlsx" if hide_padding else "")
-    with pd.ExcelWriter(tmp_out if hide_padding else output_file, engine="openpyxl") as writer:
-        summary_df.to_excel(writer, index=False, sheet_name="ΣΕΝΑΡΙΑ_SUMMARY")
+    # Μία εγγραφή: padding κρυμμένο ήδη κατά την εγγραφή, χωρίς δεύτερο άνοιγμα του αρχείου
+    workbook, header_format = open_streaming_workbook(output_file)
+    try:
+        _write_sheet_strict(workbook, "ΣΕΝΑΡΙΑ_SUMMARY", summary_df, list(summary_df.columns),
+                            header_format=header_format)
         if include_input_sheet:
-            df_with_step1.to_excel(writer, index=False, sheet_name="INPUT_DATA")
+            _write_sheet_strict(workbook, "INPUT_DATA", df_with_step1, list(df_with_step1.columns),
+                                header_format=header_format)
         for s in results.scenarios:
-            scen_col = s.column_name
-            df_s = _reorder_with_padding(df_with_step1, scen_col, scenario_col_letter, base_columns)
-            df_s.to_excel(writer, index=False, sheet_name=f"ΣΕΝΑΡΙΟ_{s.id}")
-
-    if hide_padding:
-        _hide_padding_columns(tmp_out)
-        Path(tmp_out).replace(output_file)
+            ordered, pads = _strict_column_layout(df_with_step1.columns, s.column_name,
+                                                  scenario_col_letter, base_columns)
+            _write_sheet_strict(workbook, f"ΣΕΝΑΡΙΟ_{s.id}", df_with_step1, ordered,
+                                hidden=pads if hide_padding else (), header_format=header_format)
+    finally:
+        workbook.close()
 
 
 def export_step1_per_scenario_only_STRICT(df_with_step1: pd.DataFrame, results: Step1Results,
@@ -772,16 +1698,15 @@ def export_step1_per_scenario_only_STRICT(df_with_step1: pd.DataFrame, results:
     if base_columns is None:
         base_columns = ['ΟΝΟΜΑ','ΦΥΛΟ','ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ','ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ']
 
-    tmp_out = output_file + (".tmp.xlsx" if hide_padding else "")
-    with pd.ExcelWriter(tmp_out if hide_padding else output_file, engine="openpyxl") as writer:
+    workbook, header_format = open_streaming_workbook(output_file)
+    try:
         for s in results.scenarios:
-            scen_col = s.column_name
-            df_s = _reorder_with_padding(df_with_step1, scen_col, scenario_col_letter, base_columns)
-            df_s.to_excel(writer, index=False, sheet_name=f"ΣΕΝΑΡΙΟ_{s.id}")
-
-    if hide_padding:
-        _hide_padding_columns(tmp_out)
-        Path(tmp_out).replace(output_file)
+            ordered, pads = _strict_column_layout(df_with_step1.columns, s.column_name,
+                                                  scenario_col_letter, base_columns)
+            _write_sheet_strict(workbook, f"ΣΕΝΑΡΙΟ_{s.id}", df_with_step1, ordered,
+                                hidden=pads if hide_padding else (), header_format=header_format)
+    finally:
+        workbook.close()
 
 # Override old function names to point to STRICT implementations
 save_immutable_step1_results_separate = save_immutable_step1_results_separate_STRICT
@@ -6,10 +6,15 @@ Step 2 — Ζωηροί & Ιδιαιτερότητες (Fixed v3, **patched**)
 - Όλα τα υπόλοιπα παραμένουν συμβατά.
 - ΠΡΟΣΘΗΚΗ: run_step2() wrapper function για pages compatibility
 """
-from typing import List, Dict, Tuple, Any, Set, Optional
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Any, Set, Optional, Iterator
+import numpy as np
 import pandas as pd
+import heapq
 import random
 import re
+import time
+import zlib
 
 def _auto_num_classes(df, override=None):
     import math
@@ -181,225 +186,636 @@ def _compute_targets_global(
     }
 
 
-def _prereject(assign_map, next_name, next_cl, df, step1_col, class_labels, targets) -> bool:
-    """Γρήγορο pruning πριν από απόπειρα ανάθεσης."""
-    Zc = targets["Z_step1"].copy()
-    Ic = targets["I_step1"].copy()
-    tmp = assign_map.copy()
-    if next_name and next_cl:
-        tmp[next_name] = next_cl
+@dataclass
+class _Step2Problem:
+    """
+    Μεταγλωττισμένη μορφή του roster για την αναζήτηση του Βήματος 2.
 
-    # Προσωρινή καταμέτρηση Ζ/Ι αν μπει το next
-    for n, cl in tmp.items():
-        row = df[df["ΟΝΟΜΑ"] == n].iloc[0]
-        if str(row.get("ΖΩΗΡΟΣ", "")).strip() == "Ν":
-            Zc[cl] += 1
-        if str(row.get("ΙΔΙΑΙΤΕΡΟΤΗΤΑ", "")).strip() == "Ν":
-            Ic[cl] += 1
+    Οι μαθητές είναι ακέραια row ids (πρώτη γραμμή ανά ΟΝΟΜΑ) και οι Ζ/Ι προς
+    τοποθέτηση θέσεις 0..len(to_place)-1· οι τάξεις είναι δείκτες στο class_labels.
+    Φτιάχνεται μία φορά, ώστε οι helpers της αναζήτησης να μη σκανάρουν το df.
+    """
+    class_labels: List[str]
+    names: List[str]
+    is_z: np.ndarray                 # ΖΩΗΡΟΣ == "Ν" ανά γραμμή
+    is_i: np.ndarray                 # ΙΔΙΑΙΤΕΡΟΤΗΤΑ == "Ν" ανά γραμμή
+    is_teacher: np.ndarray           # ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ == "Ν" ανά γραμμή
+    to_place: List[int]              # row ids των Ζ/Ι προς τοποθέτηση, σε σειρά δυσκολίας
+    z_step1: List[int]               # Ζ ανά τάξη από το Βήμα 1
+    i_step1: List[int]               # Ι ανά τάξη από το Βήμα 1
+    with_i_step1: List[int]          # ΖΙ + Ι-μόνο ανά τάξη από το Βήμα 1
+    z_only_step1: List[int]          # Ζ-μόνο ανά τάξη από το Βήμα 1
+    z_q: int
+    z_max: int
+    i_q: int
+    i_max: int
+    blocked: List[Set[int]]          # ανά θέση: τάξεις με σταθερό (Βήμα 1) μαθητή σε σύγκρουση
+    conflicts: List[Set[int]]        # ανά θέση: θέσεις σε σύγκρουση (και η ίδια, αν αυτο-σύγκρουση)
+    broken_fixed: int                # σπασμένες αμοιβαίες δυάδες μεταξύ σταθερών μαθητών (σταθερό)
+    pair_u: np.ndarray               # αμοιβαίες δυάδες μεταξύ θέσεων προς τοποθέτηση (u, v)
+    pair_v: np.ndarray
+    fixed_pos: np.ndarray            # αμοιβαίες δυάδες θέσης με σταθερό μαθητή: θέση ...
+    fixed_class: np.ndarray          # ... και κωδικός τάξης του σταθερού (δείκτης ή >= len(class_labels))
+    var_neighbours: List[List[int]]  # ανά θέση: θέσεις με αμοιβαία φιλία (από pair_u/pair_v)
+    fixed_neighbours: List[List[int]]  # ανά θέση: κωδικοί τάξεων σταθερών φίλων (από fixed_pos/fixed_class)
+    step1_empty: List[bool]          # τάξη χωρίς κανέναν μαθητή από το Βήμα 1 (εναλλάξιμη)
+
+
+def _yes_array(df: pd.DataFrame, col: str) -> np.ndarray:
+    """Boolean array για στήλη Ν/Ο (strip, όπως οι έλεγχοι στόχων του Βήματος 2)"""
+    if col not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    return df[col].astype(str).str.strip().eq("Ν").to_numpy()
+
+
+def _compile_step2(df: pd.DataFrame, step1_col: str, class_labels: List[str],
+                   targets: Dict[str, Dict[str, int]]) -> _Step2Problem:
+    """Μεταγλώττιση του df σε _Step2Problem (ids, boolean arrays, γειτνίαση συγκρούσεων)"""
+    names = df["ΟΝΟΜΑ"].astype(str).tolist()
+    first_row: Dict[str, int] = {}
+    for r, n in enumerate(names):
+        first_row.setdefault(n, r)
+    is_z = _yes_array(df, "ΖΩΗΡΟΣ")
+    is_i = _yes_array(df, "ΙΔΙΑΙΤΕΡΟΤΗΤΑ")
+    is_teacher = df["ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ"].astype(str).str.strip().str.upper().eq("Ν").to_numpy()
 
-    # Upper bounds per targets
-    for cl in class_labels:
-        if Zc[cl] > targets["Z"]["max"]:
-            return False
-        if Ic[cl] > targets["I"]["max"]:
-            return False
+    # Μόνο Ζ/Ι προς τοποθέτηση
+    unplaced = df[step1_col].isna().to_numpy()
+    step1 = np.array([None if u else str(cl) for u, cl in zip(unplaced, df[step1_col].tolist())], dtype=object)
+    raw_zi = ((df["ΖΩΗΡΟΣ"] == "Ν") | (df["ΙΔΙΑΙΤΕΡΟΤΗΤΑ"] == "Ν")).to_numpy()
+    to_place = [first_row[names[r]] for r in np.flatnonzero(unplaced & raw_zi)]
+
+    conf_col = df["ΣΥΓΚΡΟΥΣΗ"].tolist() if "ΣΥΓΚΡΟΥΣΗ" in df.columns else None
+    friends_col = df["ΦΙΛΟΙ"].tolist() if "ΦΙΛΟΙ" in df.columns else None
+
+    # Σειρά δυσκολίας: ΖΙ, Ι, Ζ και μετά περισσότερες συγκρούσεις + φιλίες
+    def deg(r: int) -> int:
+        return (len(parse_friends_cell(conf_col[r] if conf_col is not None else ""))
+                + len(parse_friends_cell(friends_col[r] if friends_col is not None else "")))
+
+    to_place = sorted(to_place, key=lambda r: (-int(is_z[r] and is_i[r]), -int(is_i[r]), -int(is_z[r]), -deg(r)))
+
+    blocked: List[Set[int]] = [set() for _ in to_place]
+    conflicts: List[Set[int]] = [set() for _ in to_place]
+    if conf_col is not None:
+        fixed_names = {cl: set() for cl in class_labels}
+        for n, cl in zip(names, df[step1_col].tolist()):
+            if pd.notna(cl) and cl in fixed_names:
+                fixed_names[cl].add(n)
+        position = {names[r]: p for p, r in enumerate(to_place)}
+        for p, r in enumerate(to_place):
+            toks = set(parse_friends_cell(conf_col[r]))
+            blocked[p] = {c for c, cl in enumerate(class_labels) if toks & fixed_names[cl]}
+            for t in toks:
+                if t in position:
+                    conflicts[p].add(position[t])
+                    conflicts[position[t]].add(p)
+
+    broken_fixed, pair_u, pair_v, fixed_pos, fixed_class = _compile_mutual_pairs(
+        df, step1_col, class_labels, names, is_teacher, to_place)
+    var_neighbours: List[List[int]] = [[] for _ in to_place]
+    fixed_neighbours: List[List[int]] = [[] for _ in to_place]
+    for u, v in zip(pair_u.tolist(), pair_v.tolist()):
+        var_neighbours[u].append(v)
+        var_neighbours[v].append(u)
+    for p, code in zip(fixed_pos.tolist(), fixed_class.tolist()):
+        fixed_neighbours[p].append(code)
+
+    return _Step2Problem(
+        class_labels=list(class_labels),
+        names=names,
+        is_z=is_z,
+        is_i=is_i,
+        is_teacher=is_teacher,
+        to_place=to_place,
+        z_step1=[targets["Z_step1"][cl] for cl in class_labels],
+        i_step1=[targets["I_step1"][cl] for cl in class_labels],
+        with_i_step1=[int((is_i & (step1 == cl)).sum()) for cl in class_labels],
+        z_only_step1=[int((is_z & ~is_i & (step1 == cl)).sum()) for cl in class_labels],
+        z_q=targets["Z"]["q"],
+        z_max=targets["Z"]["max"],
+        i_q=targets["I"]["q"],
+        i_max=targets["I"]["max"],
+        blocked=blocked,
+        conflicts=conflicts,
+        broken_fixed=broken_fixed,
+        pair_u=pair_u,
+        pair_v=pair_v,
+        fixed_pos=fixed_pos,
+        fixed_class=fixed_class,
+        var_neighbours=var_neighbours,
+        fixed_neighbours=fixed_neighbours,
+        step1_empty=[not (step1 == cl).any() for cl in class_labels],
+    )
 
-    # Γρήγορος έλεγχος συγκρούσεων με fixed/partial της ίδιας τάξης
-    if next_name and next_cl and "ΣΥΓΚΡΟΥΣΗ" in df.columns:
-        mask_next = (df["ΟΝΟΜΑ"] == next_name)
-        next_conf_cell = df.loc[mask_next, "ΣΥΓΚΡΟΥΣΗ"]
-        toks_next = set(parse_friends_cell(next_conf_cell.values[0] if not next_conf_cell.empty else ""))
 
-        fixed_same = df[(pd.notna(df[step1_col])) & (df[step1_col] == next_cl)]
-        if any((n in toks_next) for n in fixed_same["ΟΝΟΜΑ"].astype(str).tolist()):
-            return False
+def _compile_mutual_pairs(df: pd.DataFrame, step1_col: str, class_labels: List[str], names: List[str],
+                          is_teacher: np.ndarray, to_place: List[int]):
+    """
+    Οι αμοιβαίες δυάδες του _step2_rule_broken_pairs, υπολογισμένες μία φορά.
 
-        for n2, cl2 in tmp.items():
-            if cl2 != next_cl:
-                continue
-            mask_n2 = (df["ΟΝΟΜΑ"] == n2)
-            n2_conf_cell = df.loc[mask_n2, "ΣΥΓΚΡΟΥΣΗ"]
-            toks2 = set(parse_friends_cell(n2_conf_cell.values[0] if not n2_conf_cell.empty else ""))
-            if (next_name in toks2) or (n2 in toks_next):
-                return False
+    Παιδί εκπ/κού ή μαθητής εκτός to_place έχει σταθερή τάξη (Βήμα 1), άρα οι
+    δυάδες μεταξύ σταθερών μετρούν ως σταθερά· μένουν δυάδες θέσης-θέσης και
+    θέσης-σταθερού, ώστε στο φύλλο να αρκεί σύγκριση πινάκων τάξεων.
+    """
+    is_z = df["ΖΩΗΡΟΣ"].astype(str).str.strip().str.upper().eq("Ν").to_numpy()
+    is_i = df["ΙΔΙΑΙΤΕΡΟΤΗΤΑ"].astype(str).str.strip().str.upper().eq("Ν").to_numpy()
+    unplaced = df[step1_col].isna().to_numpy()
+    in_set = is_teacher | (unplaced & (is_z | is_i))
+    step1 = df[step1_col].tolist()
+
+    row_of = {n: r for r, n in enumerate(names)}
+    position = {r: p for p, r in enumerate(to_place)}
+    codes = {cl: c for c, cl in enumerate(class_labels)}
+
+    def slot(name: str):
+        """(θέση, None) για μεταβλητή τάξη ή (None, σταθερή τάξη ως str)"""
+        r = row_of[name]
+        if not is_teacher[r] and r in position:
+            return position[r], None
+        return None, str(step1[r]).strip()
+
+    broken_fixed = 0
+    var_pairs: List[Tuple[int, int]] = []
+    fixed_pairs: List[Tuple[int, int]] = []
+    for a, b in _mutual_pairs_all(df):
+        if not (a in row_of and b in row_of and in_set[row_of[a]] and in_set[row_of[b]]):
+            continue
+        (pa, ca), (pb, cb) = slot(a), slot(b)
+        if pa is None and pb is None:
+            broken_fixed += bool(ca and cb and ca != cb)
+        elif pa is not None and pb is not None:
+            var_pairs.append((pa, pb))
+        else:
+            p, fixed = (pa, cb) if pa is not None else (pb, ca)
+            if fixed:  # κενή σταθερή τάξη δεν μετρά ποτέ ως σπασμένη
+                fixed_pairs.append((p, codes.setdefault(fixed, len(codes))))
+
+    return (broken_fixed,
+            np.array([u for u, _ in var_pairs], dtype=np.int64),
+            np.array([v for _, v in var_pairs], dtype=np.int64),
+            np.array([p for p, _ in fixed_pairs], dtype=np.int64),
+            np.array([c for _, c in fixed_pairs], dtype=np.int64))
+
+
+def _class_penalties(with_i: int, z_only: int) -> Tuple[int, int]:
+    """
+    Κλειστή μορφή των _count_ped_conflicts / _sum_conflicts για μία τάξη με
+    with_i μαθητές με Ι (ΖΙ ή Ι-μόνο) και z_only μαθητές Ζ-μόνο:
+    κάθε ζεύγος τους συγκρούεται, με ποινή 5 (Ι-Ι), 4 (Ι-Ζ) ή 3 (Ζ-Ζ).
+    """
+    n = with_i + z_only
+    ped = n * (n - 1) // 2
+    conf = 5 * (with_i * (with_i - 1) // 2) + 4 * with_i * z_only + 3 * (z_only * (z_only - 1) // 2)
+    return ped, conf
+
+
+def _prereject(problem: _Step2Problem, p: int, c: int, zc: List[int], ic: List[int],
+               members: List[Set[int]]) -> bool:
+    """Γρήγορο pruning πριν από απόπειρα ανάθεσης της θέσης p στην τάξη c (O(βαθμός))."""
+    r = problem.to_place[p]
+    # Upper bounds per targets
+    if zc[c] + problem.is_z[r] > problem.z_max or ic[c] + problem.is_i[r] > problem.i_max:
+        return False
+    # Συγκρούσεις με fixed (Βήμα 1) ή ήδη τοποθετημένους της ίδιας τάξης
+    if c in problem.blocked[p]:
+        return False
+    conf = problem.conflicts[p]
+    if p in conf or not conf.isdisjoint(members[c]):
+        return False
     return True
 
 
-def _extract_step1_id(step1_col_name: str) -> int:
+class _TopKStore:
     """
-    Επιστρέφει τον αριθμό k από «ΒΗΜΑ1_ΣΕΝΑΡΙΟ_k» ή «V1_ΣΕΝΑΡΙΟ_k».
-    Αν δεν βρεθεί, επιστρέφει 1.
+    Φραγμένη αποθήκη των K καλύτερων λύσεων ως (κλειδί ποινής, διάνυσμα τάξεων).
+
+    Κλειδί: (0, broken, penalty) χωρίς παιδαγωγικές συγκρούσεις, αλλιώς
+    (1, penalty, broken) - ίδια σειρά κριτηρίων με την επιλογή σεναρίων.
+    Οι ισοβαθμίες λύνονται με seeded crc32 του διανύσματος: ντετερμινιστικά και
+    ανεξάρτητα από τη σειρά εύρεσης. Η μνήμη μένει O(K) όσα φύλλα κι αν εξεταστούν.
     """
-    m = re.search(r'(?:ΒΗΜΑ1_|V1_)ΣΕΝΑΡΙΟ[_\s]*(\d+)', str(step1_col_name))
-    if not m:
-        return 1
-    return int(m.group(1))
 
+    def __init__(self, k: int, seed: int = 42):
+        self.k = max(1, int(k))
+        self.seed = seed & 0xFFFFFFFF
+        self._heap: List[Tuple[Tuple[int, ...], int, Tuple[int, ...], Tuple[int, int, int]]] = []
+        self._vectors: Set[Tuple[int, ...]] = set()
 
-def step2_apply_FIXED_v3(
-    df_in: pd.DataFrame,
-    step1_col_name: str,
-    num_classes: Optional[int] = None,
-    *,
-    seed: int = 42,
-    max_results: int = 5,
-) -> List[Tuple[str, pd.DataFrame, Dict[str, Any]]]:
-    """
-    Επιστρέφει έως max_results σενάρια ως (label, DataFrame, metrics).
-    Το DataFrame περιέχει στήλες εισόδου + «ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{k}» όπου k = id του ΒΗΜΑ1_ΣΕΝΑΡΙΟ_k.
-    """
-    random.seed(seed)
-    df = normalize_columns(df_in).copy()
-    num_classes = _auto_num_classes(df, num_classes)
-    class_labels = [f"Α{i+1}" for i in range(num_classes)]
-    scope = scope_step2(df, step1_col=step1_col_name)
+    @staticmethod
+    def key(ped_cnt: int, broken: int, total: int) -> Tuple[int, int, int]:
+        return (0, broken, total) if ped_cnt == 0 else (1, total, broken)
 
-    # Μόνο Ζ/Ι προς τοποθέτηση
-    to_place = df[(pd.isna(df[step1_col_name])) & ((df["ΖΩΗΡΟΣ"] == "Ν") | (df["ΙΔΙΑΙΤΕΡΟΤΗΤΑ"] == "Ν"))]["ΟΝΟΜΑ"].astype(str).tolist()
-    targets = _compute_targets_global(df, step1_col=step1_col_name, class_labels=class_labels)
+    def __len__(self) -> int:
+        return len(self._heap)
 
-    best: List[Tuple[pd.DataFrame, int, int, int, int]] = []
-    assign: Dict[str, str] = {}
-
-    # Σειρά δυσκολίας
-    def deg(name: str) -> int:
-        row = df[df["ΟΝΟΜΑ"] == name].iloc[0]
-        return len(parse_friends_cell(row.get("ΣΥΓΚΡΟΥΣΗ", ""))) + len(parse_friends_cell(row.get("ΦΙΛΟΙ", "")))
-
-    to_place_sorted = sorted(
-        to_place,
-        key=lambda n: (
-            -(
-                str(df.loc[df["ΟΝΟΜΑ"] == n, "ΖΩΗΡΟΣ"].values[0]).strip() == "Ν"
-                and str(df.loc[df["ΟΝΟΜΑ"] == n, "ΙΔΙΑΙΤΕΡΟΤΗΤΑ"].values[0]).strip() == "Ν"
-            ),
-            -(str(df.loc[df["ΟΝΟΜΑ"] == n, "ΙΔΙΑΙΤΕΡΟΤΗΤΑ"].values[0]).strip() == "Ν"),
-            -(str(df.loc[df["ΟΝΟΜΑ"] == n, "ΖΩΗΡΟΣ"].values[0]).strip() == "Ν"),
-            -deg(n),
-        ),
-    )
+    def worst_key(self) -> Optional[Tuple[int, int, int]]:
+        """Το κλειδί της K-οστής λύσης (None αν η αποθήκη δεν έχει γεμίσει)"""
+        if len(self._heap) < self.k:
+            return None
+        return tuple(-x for x in self._heap[0][0])
 
-    def backtrack(i: int) -> None:
-        if i == len(to_place_sorted):
-            cand = df.copy()
-            cand_col = "ΒΗΜΑ2_TMP"
-            cand[cand_col] = cand[step1_col_name]
-            for n, cl in assign.items():
-                cand.loc[cand["ΟΝΟΜΑ"] == n, cand_col] = cl
+    def offer(self, vector: Tuple[int, ...], ped_cnt: int, broken: int, total: int) -> bool:
+        """Προσθέτει λύση αν είναι ανάμεσα στις K καλύτερες· True αν κρατήθηκε"""
+        if vector in self._vectors:
+            return False
+        key = self.key(ped_cnt, broken, total)
+        entry = (tuple(-x for x in key), -zlib.crc32(bytes(vector), self.seed), vector, (ped_cnt, broken, total))
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            self._vectors.discard(heapq.heapreplace(self._heap, entry)[2])
+        else:
+            return False
+        self._vectors.add(vector)
+        return True
+
+    def best_key(self) -> Optional[Tuple[int, int, int]]:
+        """Το κλειδί της καλύτερης λύσης (None αν η αποθήκη είναι άδεια)"""
+        if not self._heap:
+            return None
+        return tuple(-x for x in max(e[0] for e in self._heap))
+
+    def winners(self) -> List[Tuple[Tuple[int, ...], Tuple[int, int, int]]]:
+        """Οι λύσεις με το καλύτερο κλειδί, σε λεξικογραφική σειρά διανύσματος (σειρά DFS)"""
+        if not self._heap:
+            return []
+        best = max(e[0] for e in self._heap)
+        return sorted((e[2], e[3]) for e in self._heap if e[0] == best)
 
+
+def _canonical_vector(vector: List[int], empty_classes: List[int]) -> Tuple[int, ...]:
+    """Μετονομάζει τις εναλλάξιμες (άδειες στο Βήμα 1) τάξεις με σειρά πρώτης εμφάνισης"""
+    if len(empty_classes) < 2:
+        return tuple(vector)
+    empty = set(empty_classes)
+    relabel: Dict[int, int] = {}
+    for c in vector:
+        if c in empty and c not in relabel:
+            relabel[c] = empty_classes[len(relabel)]
+    return tuple(relabel.get(c, c) for c in vector)
+
+
+# Ανά πόσους κόμβους ελέγχεται το χρονικό όριο της αναζήτησης
+_DEADLINE_CHECK_NODES = 256
+
+
+def _search_step2(problem: _Step2Problem, store: _TopKStore, prune: bool = True,
+                  max_nodes: Optional[int] = None, deadline: Optional[float] = None):
+    """
+    DFS των αναθέσεων Ζ/Ι που γεμίζει το store (generator).
+
+    Κάνει yield τα στατιστικά κάθε φορά που βελτιώνεται η καλύτερη λύση του
+    store. Σταματά μετά από max_nodes κόμβους ή όταν το time.monotonic()
+    φτάσει το deadline· τότε complete=False και το store κρατά ό,τι βρέθηκε.
+
+    Με prune=True:
+      - forward checking: κάθε θέση κρατά bitmask επιτρεπτών τάξεων (συγκρούσεις
+        με σταθερούς και ήδη τοποθετημένους, άνω όρια Ζ/Ι)· επόμενη τοποθετείται
+        η θέση με τις λιγότερες επιτρεπτές τάξεις και ο κλάδος κόβεται μόλις
+        κάποια θέση μείνει χωρίς τάξη,
+      - κάτω φράγμα του κλειδιού ποινής από τους ήδη σταθερούς μετρητές
+        (συγκρούσεις, σπασμένες δυάδες) συν την ελάχιστη ποινή που θα προσθέσει
+        κάθε Ζ/Ι που απομένει στις επιτρεπτές του τάξεις· κόβεται ό,τι είναι αυστηρά χειρότερο από την K-οστή λύση,
+      - κόβεται ό,τι δεν μπορεί πια να φτάσει το κάτω όριο q των στόχων Ζ/Ι,
+      - από τις τάξεις χωρίς μαθητές στο Βήμα 1 που είναι ακόμη άδειες
+        δοκιμάζεται μόνο η πρώτη (είναι εναλλάξιμες).
+    Οι λύσεις καταχωρούνται σε canonical μορφή, άρα prune=False (εξαντλητική
+    αναζήτηση με τη σειρά δυσκολίας και μόνο _prereject) δίνει ακριβώς τις ίδιες λύσεις.
+
+    Returns:
+        (ως τιμή του StopIteration) στατιστικά: nodes (κόμβοι), leaves (έγκυρα
+        φύλλα), pruned (κομμένοι κλάδοι), complete (αν εξαντλήθηκε η αναζήτηση)
+    """
+    n_classes = len(problem.class_labels)
+    to_place = problem.to_place
+    n_place = len(to_place)
+    is_z = [bool(problem.is_z[r]) for r in to_place]
+    has_i = [bool(problem.is_i[r]) for r in to_place]
+    empty_classes = [c for c in range(n_classes) if problem.step1_empty[c]]
+    stats: Dict[str, Any] = {"nodes": 0, "leaves": 0, "pruned": 0, "complete": False}
+    node_limit = -1 if max_nodes is None else max_nodes
+    stopped = [False]
+
+    assign: List[int] = [-1] * n_place
+    zc = list(problem.z_step1)
+    ic = list(problem.i_step1)
+    with_i = list(problem.with_i_step1)
+    z_only = list(problem.z_only_step1)
+    members: List[Set[int]] = [set() for _ in range(n_classes)]
+    # Παιδαγωγικές συγκρούσεις, ποινή και σπασμένες δυάδες ενημερώνονται σταδιακά ανά ανάθεση
+    ped, conf = 0, 0
+    for c in range(n_classes):
+        d_ped, d_conf = _class_penalties(with_i[c], z_only[c])
+        ped += d_ped
+        conf += d_conf
+    state = {"ped": ped, "conf": conf, "broken": problem.broken_fixed}
+    # Όσοι απομένουν: με Ι, Ζ-μόνο, με Ζ
+    remaining = [sum(has_i), n_place - sum(has_i), sum(is_z)]
+
+    # Αν το Βήμα 1 ήδη ξεπερνά τα άνω όρια Ζ/Ι, καμία ανάθεση δεν περνά το pruning
+    if any(z > problem.z_max or i > problem.i_max for z, i in zip(zc, ic)):
+        stats["complete"] = True
+        return stats
+
+    def reachable() -> bool:
+        # Οι μετρητές μόνο αυξάνονται: τα ελλείμματα ως το q πρέπει να καλύπτονται από όσους απομένουν
+        deficit_z = sum(max(0, problem.z_q - z) for z in zc)
+        deficit_i = sum(max(0, problem.i_q - i) for i in ic)
+        return deficit_z <= remaining[2] and deficit_i <= remaining[0]
+
+    # Forward checking: bitmask επιτρεπτών τάξεων ανά θέση. Αφαιρούνται οι τάξεις
+    # με σταθερό αντίπαλο (blocked) και, κατά την αναζήτηση, οι τάξεις όπου
+    # τοποθετήθηκε αντίπαλος· οι γεμάτες ως το άνω όριο Ζ/Ι τάξεις είναι κοινές μάσκες.
+    all_classes = (1 << n_classes) - 1
+    domains = [0 if p in problem.conflicts[p]
+               else all_classes & ~sum(1 << c for c in problem.blocked[p]) for p in range(n_place)]
+    full = {"z": sum(1 << c for c in range(n_classes) if zc[c] >= problem.z_max),
+            "i": sum(1 << c for c in range(n_classes) if ic[c] >= problem.i_max)}
+
+    def allowed(p: int) -> int:
+        mask = domains[p]
+        if is_z[p]:
+            mask &= ~full["z"]
+        if has_i[p]:
+            mask &= ~full["i"]
+        return mask
+
+    def choose() -> int:
+        """Η θέση με τις λιγότερες επιτρεπτές τάξεις (MRV, ισοπαλία: σειρά δυσκολίας)· -1 αν κάποια μένει χωρίς τάξη"""
+        best_p, best_size = -1, n_classes + 1
+        for p in range(n_place):
+            if assign[p] >= 0:
+                continue
+            size = bin(allowed(p)).count("1")
+            if size == 0:
+                return -1
+            if size < best_size:
+                best_p, best_size = p, size
+        return best_p
+
+    def bound_key() -> Tuple[int, int, int]:
+        # Κάθε Ζ/Ι που απομένει προσθέτει τουλάχιστον την ελάχιστη ποινή στις επιτρεπτές του τάξεις
+        extra = 0
+        forced = state["ped"] > 0
+        for p in range(n_place):
+            if assign[p] >= 0:
+                continue
+            mask = allowed(p)
+            costs = [(5 * with_i[c] + 4 * z_only[c]) if has_i[p] else (4 * with_i[c] + 3 * z_only[c])
+                     for c in range(n_classes) if mask >> c & 1]
+            if costs:
+                extra += min(costs)
+                forced = forced or min(with_i[c] + z_only[c] for c in range(n_classes) if mask >> c & 1) > 0
+        broken = state["broken"]
+        return store.key(int(forced), broken, state["conf"] + extra + 5 * broken)
+
+    def backtrack(depth: int):
+        if stopped[0]:
+            return
+        if stats["nodes"] == node_limit or (deadline is not None and stats["nodes"] % _DEADLINE_CHECK_NODES == 0
+                                            and time.monotonic() >= deadline):
+            stopped[0] = True
+            return
+        stats["nodes"] += 1
+        if depth == n_place:
             # reject "όλοι στην ίδια τάξη"
-            counts_new = {cl: 0 for cl in class_labels}
-            for cl in assign.values():
-                counts_new[cl] += 1
-            if sum(counts_new.values()) > 0 and max(counts_new.values()) == sum(counts_new.values()):
+            if n_place and max(len(m) for m in members) == n_place:
                 return
 
             # έλεγχος στόχων Ζ/Ι
-            Zc = targets["Z_step1"].copy()
-            Ic = targets["I_step1"].copy()
-            for n, cl in assign.items():
-                row = df[df["ΟΝΟΜΑ"] == n].iloc[0]
-                if str(row.get("ΖΩΗΡΟΣ", "")).strip() == "Ν":
-                    Zc[cl] += 1
-                if str(row.get("ΙΔΙΑΙΤΕΡΟΤΗΤΑ", "")).strip() == "Ν":
-                    Ic[cl] += 1
-            for cl in class_labels:
-                if not (targets["Z"]["q"] <= Zc[cl] <= targets["Z"]["max"]):
+            for c in range(n_classes):
+                if not (problem.z_q <= zc[c] <= problem.z_max):
                     return
-                if not (targets["I"]["q"] <= Ic[cl] <= targets["I"]["max"]):
+                if not (problem.i_q <= ic[c] <= problem.i_max):
                     return
 
-            ped_cnt = _count_ped_conflicts(cand, cand_col)
-            conf_sum = _sum_conflicts(cand, cand_col)
-            broken = _step2_rule_broken_pairs(cand, step1_col_name, cand_col)
-            total = conf_sum + 5 * broken
-            best.append((cand, ped_cnt, broken, total, conf_sum))
+            stats["leaves"] += 1
+            broken = state["broken"]
+            incumbent = store.best_key()
+            if (store.offer(_canonical_vector(assign, empty_classes),
+                            state["ped"], broken, state["conf"] + 5 * broken)
+                    and store.best_key() != incumbent):
+                yield stats
             return
 
-        name = to_place_sorted[i]
-        for cl in class_labels:
-            if not _prereject(assign, name, cl, df, step1_col_name, class_labels, targets):
+        if prune:
+            worst = store.worst_key()
+            if not reachable() or (worst is not None and bound_key() > worst):
+                stats["pruned"] += 1
+                return
+            p = choose()
+            if p < 0:
+                stats["pruned"] += 1
+                return
+            mask = allowed(p)
+        else:
+            p = depth
+
+        tried_empty = False
+        for c in range(n_classes):
+            if prune:
+                if not mask >> c & 1:
+                    continue
+                if problem.step1_empty[c] and not members[c]:
+                    if tried_empty:
+                        continue
+                    tried_empty = True
+            elif not _prereject(problem, p, c, zc, ic, members):
                 continue
-            assign[name] = cl
-            backtrack(i + 1)
-            del assign[name]
+            # Νέα ζεύγη συγκρούσεων με όσους Ζ/Ι είναι ήδη στην τάξη, νέες σπασμένες δυάδες
+            d_ped = with_i[c] + z_only[c]
+            d_conf = (5 * with_i[c] + 4 * z_only[c]) if has_i[p] else (4 * with_i[c] + 3 * z_only[c])
+            d_broken = (sum(1 for q in problem.var_neighbours[p] if assign[q] >= 0 and assign[q] != c)
+                        + sum(1 for code in problem.fixed_neighbours[p] if code != c))
+            assign[p] = c
+            zc[c] += is_z[p]
+            ic[c] += has_i[p]
+            if has_i[p]:
+                with_i[c] += 1
+                remaining[0] -= 1
+            else:
+                z_only[c] += 1
+                remaining[1] -= 1
+            remaining[2] -= is_z[p]
+            state["ped"] += d_ped
+            state["conf"] += d_conf
+            state["broken"] += d_broken
+            members[c].add(p)
+            bit = 1 << c
+            narrowed = [q for q in problem.conflicts[p] if assign[q] < 0 and domains[q] & bit]
+            for q in narrowed:
+                domains[q] &= ~bit
+            saved_full = (full["z"], full["i"])
+            if zc[c] >= problem.z_max:
+                full["z"] |= bit
+            if ic[c] >= problem.i_max:
+                full["i"] |= bit
+            yield from backtrack(depth + 1)
+            full["z"], full["i"] = saved_full
+            for q in narrowed:
+                domains[q] |= bit
+            members[c].discard(p)
+            state["broken"] -= d_broken
+            state["conf"] -= d_conf
+            state["ped"] -= d_ped
+            remaining[2] += is_z[p]
+            if has_i[p]:
+                with_i[c] -= 1
+                remaining[0] += 1
+            else:
+                z_only[c] -= 1
+                remaining[1] += 1
+            ic[c] -= has_i[p]
+            zc[c] -= is_z[p]
+            assign[p] = -1
+
+    yield from backtrack(0)
+    stats["complete"] = not stopped[0]
+    return stats
+
+
+def _extract_step1_id(step1_col_name: str) -> int:
+    """
+    Επιστρέφει τον αριθμό k από «ΒΗΜΑ1_ΣΕΝΑΡΙΟ_k» ή «V1_ΣΕΝΑΡΙΟ_k».
+    Αν δεν βρεθεί, επιστρέφει 1.
+    """
+    m = re.search(r'(?:ΒΗΜΑ1_|V1_)ΣΕΝΑΡΙΟ[_\s]*(\d+)', str(step1_col_name))
+    if not m:
+        return 1
+    return int(m.group(1))
 
-    backtrack(0)
+
+def _step2_results(df: pd.DataFrame, step1_col_name: str, problem: _Step2Problem, best: _TopKStore,
+                   stats: Dict[str, Any]) -> List[Tuple[str, pd.DataFrame, Dict[str, Any]]]:
+    """Τα σενάρια (label, DataFrame, metrics) από τις τρέχουσες λύσεις του store"""
+    base_id = _extract_step1_id(step1_col_name)
 
     # Αν δεν βρέθηκε τίποτα, «pass-through»
-    if not best:
+    if not len(best):
         tmp = df.copy()
         # Στήλη Β2: να πάρει id από το step1_col_name
-        base_id = _extract_step1_id(step1_col_name)
         tmp[f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{base_id}"] = tmp[step1_col_name]
         return [("option_1", tmp, {"ped_conflicts": None, "broken": None, "penalty": None})]
 
     # --- Επιλογή σεναρίων ---
-    zero_ped = [x for x in best if x[1] == 0]
-    selected = []
-
-    # Για ρητή ορολογία «διατηρημένες φιλίες», υπολογίζουμε το σταθερό πλήθος συνολικών αμοιβαίων
-    total_pairs = len(mutual_pairs_in_scope(df, scope))
-
-    if zero_ped:
-        # 1) λιγότερα broken
-        min_broken = min(x[2] for x in zero_ped)
-        tier1 = [x for x in zero_ped if x[2] == min_broken]
-        # 2) χαμηλότερο συνολικό penalty
-        min_total = min(x[3] for x in tier1)
-        tier2 = [x for x in tier1 if x[3] == min_total]
-        # 3) τυχαία αν > max_results
-        if len(tier2) > max_results:
-            random.shuffle(tier2)
-            tier2 = tier2[:max_results]
-        selected = tier2
-    else:
-        # ΌΛΑ έχουν παιδαγωγικές συγκρούσεις (Υποχρεωτική Τοποθέτηση)
-        # 1) μικρότερο συνολικό penalty
-        min_total = min(x[3] for x in best)
-        tier1 = [x for x in best if x[3] == min_total]
-        # 2) ΠΕΡΙΣΣΟΤΕΡΕΣ διατηρημένες φιλίες  ==  (total_pairs - broken) μέγιστο
-        max_preserved = max(total_pairs - x[2] for x in tier1)
-        tier2 = [x for x in tier1 if (total_pairs - x[2]) == max_preserved]
-        # 3) τυχαία αν > max_results
-        if len(tier2) > max_results:
-            random.shuffle(tier2)
-            tier2 = tier2[:max_results]
-        selected = tier2
-
-    # --- Κατασκευή αποτελεσμάτων ---
+    # Η αποθήκη κρατά ήδη τις max_results καλύτερες κατά (συγκρούσεις, broken, penalty):
+    # χωρίς παιδαγωγικές συγκρούσεις -> λιγότερα broken, μετά χαμηλότερο penalty·
+    # αλλιώς (Υποχρεωτική Τοποθέτηση) -> χαμηλότερο penalty, μετά περισσότερες
+    # διατηρημένες φιλίες (= λιγότερα broken)
+    selected = best.winners()
+
+    # --- Κατασκευή αποτελεσμάτων (DataFrame μόνο για τις τελικές λύσεις) ---
     results: List[Tuple[str, pd.DataFrame, Dict[str, Any]]] = []
-    base_id = _extract_step1_id(step1_col_name)
-    for k, (cand, ped_cnt, broken, total, conf_sum) in enumerate(selected, start=1):
-        out = cand.copy()
+    names = df["ΟΝΟΜΑ"].astype(str)
+    for k, (vector, (ped_cnt, broken, total)) in enumerate(selected, start=1):
+        out = df.copy()
+        name_class = {problem.names[r]: problem.class_labels[c] for r, c in zip(problem.to_place, vector)}
+        assigned = names.map(name_class)
         # ΠΑΝΤΑ οριστικοποιούμε τη στήλη ως «ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{base_id}»
         final_col = f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{base_id}"
-        out[final_col] = out["ΒΗΜΑ2_TMP"]
-        out.drop(columns=["ΒΗΜΑ2_TMP"], inplace=True)
+        out[final_col] = out[step1_col_name]
+        if pd.api.types.is_numeric_dtype(out[final_col]):  # π.χ. όλα NaN -> float64
+            out[final_col] = out[final_col].astype(object)
+        mask = assigned.notna().to_numpy()
+        out.loc[mask, final_col] = assigned[mask]
         results.append(
             (
                 f"option_{k}",
                 out,
-                {"ped_conflicts": int(ped_cnt), "broken": int(broken), "penalty": int(total)},
+                {"ped_conflicts": int(ped_cnt), "broken": int(broken), "penalty": int(total),
+                 "search_nodes": stats["nodes"], "search_complete": stats["complete"]},
             )
         )
     return results
 
 
+def step2_iter_FIXED_v3(
+    df_in: pd.DataFrame,
+    step1_col_name: str,
+    num_classes: Optional[int] = None,
+    *,
+    seed: int = 42,
+    max_results: int = 5,
+    prune: bool = True,
+    max_seconds: Optional[float] = None,
+    max_nodes: Optional[int] = None,
+) -> Iterator[Tuple[List[Tuple[str, pd.DataFrame, Dict[str, Any]]], Dict[str, Any]]]:
+    """
+    Anytime μορφή του step2_apply_FIXED_v3: generator από (σενάρια, στατιστικά).
+
+    Κάνει yield κάθε φορά που βρίσκεται λύση καλύτερη από όλες τις προηγούμενες
+    και μία τελευταία φορά στο τέλος με τα τελικά σενάρια (pass-through αν δεν
+    βρέθηκε κανένα). Με max_seconds / max_nodes η αναζήτηση σταματά νωρίτερα και
+    τα τελικά σενάρια είναι τα καλύτερα ως εκείνη τη στιγμή (stats["complete"] = False).
+
+    Στατιστικά: nodes, leaves, pruned, elapsed (δευτερόλεπτα) και complete, που
+    γίνεται True μόνο στο τελευταίο yield αν η αναζήτηση ολοκληρώθηκε.
+    """
+    started = time.monotonic()
+    deadline = None if max_seconds is None else started + max_seconds
+
+    df = normalize_columns(df_in).copy()
+    num_classes = _auto_num_classes(df, num_classes)
+    class_labels = [f"Α{i+1}" for i in range(num_classes)]
+
+    targets = _compute_targets_global(df, step1_col=step1_col_name, class_labels=class_labels)
+    problem = _compile_step2(df, step1_col_name, class_labels, targets)
+
+    best = _TopKStore(max_results, seed)
+    search = _search_step2(problem, best, prune=prune, max_nodes=max_nodes, deadline=deadline)
+    while True:
+        try:
+            stats = next(search)
+        except StopIteration as done:
+            stats = done.value
+            break
+        yield _step2_results(df, step1_col_name, problem, best, stats), dict(stats, elapsed=time.monotonic() - started)
+
+    yield _step2_results(df, step1_col_name, problem, best, stats), dict(stats, elapsed=time.monotonic() - started)
+
+
+def step2_apply_FIXED_v3(
+    df_in: pd.DataFrame,
+    step1_col_name: str,
+    num_classes: Optional[int] = None,
+    *,
+    seed: int = 42,
+    max_results: int = 5,
+    prune: bool = True,
+    max_seconds: Optional[float] = None,
+    max_nodes: Optional[int] = None,
+) -> List[Tuple[str, pd.DataFrame, Dict[str, Any]]]:
+    """
+    Επιστρέφει έως max_results σενάρια ως (label, DataFrame, metrics).
+    Το DataFrame περιέχει στήλες εισόδου + «ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{k}» όπου k = id του ΒΗΜΑ1_ΣΕΝΑΡΙΟ_k.
+    Με prune=False η αναζήτηση είναι εξαντλητική (ίδια σενάρια, περισσότεροι κόμβοι·
+    βλ. metrics["search_nodes"]). Με max_seconds / max_nodes επιστρέφονται τα
+    καλύτερα σενάρια ως το όριο (βλ. step2_iter_FIXED_v3).
+    """
+    results: List[Tuple[str, pd.DataFrame, Dict[str, Any]]] = []
+    for results, _ in step2_iter_FIXED_v3(df_in, step1_col_name, num_classes, seed=seed, max_results=max_results,
+                                          prune=prune, max_seconds=max_seconds, max_nodes=max_nodes):
+        pass
+    return results
+
+
 # =============================================================================
 # WRAPPER FUNCTION ΓΙΑ PAGES COMPATIBILITY 
 # =============================================================================
 
-def run_step2(df: pd.DataFrame, step1_col: str = None, num_classes: int = 2) -> Dict[str, Any]:
+def run_step2(df: pd.DataFrame, step1_col: str = None, num_classes: int = 2,
+              max_seconds: Optional[float] = None) -> Dict[str, Any]:
     """
     Wrapper function για Βήμα 2 - Ζωηροί & Ιδιαιτερότητες
     Καλείται από το page2_vimata.py για compatibility με την υπάρχουσα δομή.
-    
+
     Args:
         df: DataFrame από βήμα 1
         step1_col: Στήλη αποτελεσμάτων βήματος 1
         num_classes: Αριθμός τμημάτων
-        
+        max_seconds: Χρονικό όριο αναζήτησης (None = χωρίς όριο)
+
     Returns:
         Dict με "df", "scenarios", "meta"
     """
@@ -411,25 +827,26 @@ def run_step2(df: pd.DataFrame, step1_col: str = None, num_classes: int = 2) ->
                 step1_col = step1_cols[0]
             else:
                 raise ValueError("Δεν βρέθηκε στήλη βήματος 1")
-        
+
         # Κλήση κύριας function
         scenarios = step2_apply_FIXED_v3(
             df, 
             step1_col_name=step1_col,
             num_classes=num_classes,
-            max_results=5
+            max_results=5,
+            max_seconds=max_seconds,
         )
-        
+
         if not scenarios:
             return {
                 "df": df,
                 "scenarios": {},
                 "meta": {"step": 2, "error": "Δεν βρέθηκαν σενάρια"}
             }
-        
+
         # Παίρνουμε το καλύτερο σενάριο
         best_scenario_name, best_df, best_metrics = scenarios[0]
-        
+
         # Format για compatibility με pages
         return {
             "df": best_df,
@@ -444,10 +861,11 @@ def run_step2(df: pd.DataFrame, step1_col: str = None, num_classes: int = 2) ->
                 "step": 2,
                 "description": "Ζωηροί & Ιδιαιτερότητες",
                 "step1_column": step1_col,
-                "all_scenarios": len(scenarios)
+                "all_scenarios": len(scenarios),
+                "search_complete": best_metrics.get("search_complete", True),
             }
         }
-        
+
     except Exception as e:
         return {
             "df": df,
@@ -459,6 +877,7 @@ def run_step2(df: pd.DataFrame, step1_col: str = None, num_classes: int = 2) ->
 if __name__ == "__main__":
     print("Step 2 Module - Έτοιμο για import")
     print("Core function: step2_apply_FIXED_v3()")
+    print("Anytime generator: step2_iter_FIXED_v3()")
     print("Wrapper function: run_step2() για pages compatibility")
 
 # =============================================================================
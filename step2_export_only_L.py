@@ -13,83 +13,52 @@
 
 from __future__ import annotations
 
+import ast
 import re
 import numpy as np
 import pandas as pd
 
-# --- Προσπάθεια import helpers, αλλιώς ασφαλές fallback ---
-try:
-    from step_2_helpers_FIXED import mutual_pairs_in_scope, scope_step2
-except Exception:
-    import ast
-    import pandas as _pd
-    import re as _re
-    SAFE_SEP = _re.compile(r"[,\|\;/·\n]+")
+from core_io_utils import open_streaming_workbook, write_sheet_rows
 
-    def _parse_friends_cell(x):
-        if isinstance(x, list):
-            return [str(s).strip() for s in x if str(s).strip()]
-        if _pd.isna(x):
-            return []
-        s = str(x).strip()
-        if not s:
-            return []
+# --- Parsing ΦΙΛΟΙ (ίδιοι κανόνες με το friendship_filters_fixed.parse_friends_cell) ---
+SAFE_SEP = re.compile(r"[,\|\;/·\n]+")
+
+def _parse_friends_cell(x):
+    if isinstance(x, list):
+        return [str(s).strip() for s in x if str(s).strip()]
+    if pd.isna(x):
+        return []
+    s = str(x).strip()
+    if not s:
+        return []
+    if s[0] in "[(":  # μόνο τότε μπορεί να είναι Python list
         try:
             v = ast.literal_eval(s)
             if isinstance(v, list):
                 return [str(t).strip() for t in v if str(t).strip()]
         except Exception:
             pass
-        parts = SAFE_SEP.split(s)
-        return [p.strip() for p in parts if p.strip() and p.strip().lower() != "nan"]
-
-    def _are_mutual_friends(df: _pd.DataFrame, a: str, b: str) -> bool:
-        ra = df[df["ΟΝΟΜΑ"].astype(str) == str(a)]
-        rb = df[df["ΟΝΟΜΑ"].astype(str) == str(b)]
-        if ra.empty or rb.empty:
-            return False
-        fa = set(_parse_friends_cell(ra.iloc[0].get("ΦΙΛΟΙ", "")))
-        fb = set(_parse_friends_cell(rb.iloc[0].get("ΦΙΛΟΙ", "")))
-        return (str(b).strip() in fa) and (str(a).strip() in fb)
-
-    def scope_step2(df: _pd.DataFrame, step1_col: str):
-        s = set()
-        for _, r in df.iterrows():
-            placed = _pd.notna(r.get(step1_col))
-            z = str(r.get("ΖΩΗΡΟΣ", "")).strip() == "Ν"
-            i = str(r.get("ΙΔΙΑΙΤΕΡΟΤΗΤΑ", "")).strip() == "Ν"
-            pk = str(r.get("ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ", "")).strip() == "Ν"
-            if (not placed and (z or i)) or (placed and pk):
-                s.add(str(r.get("ΟΝΟΜΑ", "")).strip())
-        return s
-
-    def mutual_pairs_in_scope(df: _pd.DataFrame, scope):
-        scope = {str(x).strip() for x in scope if str(x).strip()}
-        pairs = []
-        names = sorted(scope)
-        for i, a in enumerate(names):
-            for b in names[i + 1 :]:
-                if _are_mutual_friends(df, a, b):
-                    pairs.append((a, b))
-        return pairs
+    parts = SAFE_SEP.split(s)
+    return [p.strip() for p in parts if p.strip() and p.strip().lower() != "nan"]
 
 # --- Utilities ---
 def _scenario_id_from_col(col_name: str) -> int | None:
     m = re.search(r"ΣΕΝΑΡΙΟ[_\s]*(\d+)", str(col_name))
     return int(m.group(1)) if m else None
 
-def _ensure_KL_positions(df: pd.DataFrame, step1_col_name: str, step2_col_name: str) -> pd.DataFrame:
+def _KL_layout(columns, step1_col_name: str, step2_col_name: str) -> list[tuple[str, str | None]]:
     """
-    Διασφαλίζει ότι:
-    - Υπάρχουν στήλες ΒΗΜΑ1_ΣΕΝΑΡΙΟ_{sid} & ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{sid} με αυτά ακριβώς τα ονόματα
-    - Βρίσκονται στις θέσεις K (index 10) και L (index 11) αντίστοιχα
-    - Γίνεται padding με fillers αν λείπουν στήλες πριν από την K
+    Διάταξη φύλλου ως λίστα (header, στήλη-πηγή του df ή None για filler), ώστε:
+    - Οι στήλες ΒΗΜΑ1_ΣΕΝΑΡΙΟ_{sid} & ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{sid} να έχουν αυτά ακριβώς τα ονόματα
+      (με πηγή τις step1_col_name / step2_col_name)
+    - Να βρίσκονται στις θέσεις K (index 10) και L (index 11) αντίστοιχα
+    - Να μπαίνουν fillers αν λείπουν στήλες πριν από την K
+    Άλλες στήλες ΒΗΜΑ1_/ΒΗΜΑ2_ΣΕΝΑΡΙΟ_* παραλείπονται. Το df δεν αντιγράφεται.
     """
-    df2 = df.copy()
-
+    columns = list(columns)
     sid = _scenario_id_from_col(step1_col_name) or _scenario_id_from_col(step2_col_name)
     if sid is None:
-        for c in df2.columns:
+        for c in columns:
             sid = _scenario_id_from_col(c)
             if sid is not None:
                 break
@@ -97,46 +66,46 @@ def _ensure_KL_positions(df: pd.DataFrame, step1_col_name: str, step2_col_name:
     s1_target = f"ΒΗΜΑ1_ΣΕΝΑΡΙΟ_{sid}"
     s2_target = f"ΒΗΜΑ2_ΣΕΝΑΡΙΟ_{sid}"
 
-    # Δημιουργία/μετονομασία στόχων
-    if step1_col_name != s1_target:
-        df2[s1_target] = df2[step1_col_name]
-    if step2_col_name != s2_target:
-        df2[s2_target] = df2[step2_col_name]
+    layout = [(c, c) for c in columns
+              if c not in (s1_target, s2_target)
+              and not str(c).startswith("ΒΗΜΑ1_ΣΕΝΑΡΙΟ_") and not str(c).startswith("ΒΗΜΑ2_ΣΕΝΑΡΙΟ_")]
 
-    # Καθαρισμός άλλων παρόμοιων στηλών
-    to_drop = [c for c in df2.columns
-               if (str(c).startswith("ΒΗΜΑ1_ΣΕΝΑΡΙΟ_") and c != s1_target)
-               or (str(c).startswith("ΒΗΜΑ2_ΣΕΝΑΡΙΟ_") and c != s2_target)]
-    if to_drop:
-        df2 = df2.drop(columns=to_drop)
+    # Fillers μέχρι να υπάρξουν τουλάχιστον 10 στήλες πριν από K
+    while len(layout) < 10:
+        layout.append((f"_FILLER_{len(layout)}", None))
 
-    # Αναδιάταξη ώστε οι στήλες-στόχοι να κάτσουν σε K/L
-    cols = [c for c in df2.columns if c not in (s1_target, s2_target)]
+    return layout[:10] + [(s1_target, step1_col_name), (s2_target, step2_col_name)] + layout[10:]
 
-    # Fillers μέχρι να υπάρξουν τουλάχιστον 10 στήλες πριν από K
-    while len(cols) < 10:
-        filler = f"_FILLER_{len(cols)}"
-        df2[filler] = np.nan
-        cols.append(filler)
+def _ensure_KL_positions(df: pd.DataFrame, step1_col_name: str, step2_col_name: str) -> pd.DataFrame:
+    """DataFrame με τη διάταξη του _KL_layout (για όσους χρειάζονται το πλαίσιο και όχι αρχείο)"""
+    layout = _KL_layout(df.columns, step1_col_name, step2_col_name)
+    return pd.DataFrame({h: (df[src] if src is not None else np.nan) for h, src in layout}, index=df.index)
 
-    cols = cols[:10] + [s1_target, s2_target] + cols[10:]
-    df2 = df2.reindex(columns=cols)
-    return df2
+def _write_sheet(workbook, sheet_name: str, df: pd.DataFrame, layout: list[tuple[str, str | None]], header_format):
+    """Γράφει τις στήλες του layout (write_sheet_rows)· τα fillers και τα NaN μένουν κενά κελιά"""
+    return write_sheet_rows(workbook, sheet_name, [(h, df[src] if src is not None else None) for h, src in layout],
+                            header_format)
 
-def _count_broken_pairs(df: pd.DataFrame, step1_col_name: str, step2_col_name: str) -> int:
+def _mutual_pairs_rows(df: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
     """
-    Υπολογίζει αριθμό «σπασμένων» πλήρως αμοιβαίων ΔΥΑΔΩΝ στο scope του Βήματος 2,
-    με βάση την τοποθέτηση της στήλης ΒΗΜΑ2_ΣΕΝΑΡΙΟ_N (ή όποια δοθεί ως step2_col_name).
+    Οι πλήρως αμοιβαίες δυάδες ως δείκτες γραμμών (u, v), μία φορά ανά ζεύγος.
+    Κάθε όνομα αντιστοιχεί στην πρώτη γραμμή του· η αμοιβαιότητα ελέγχεται με
+    join της λίστας ακμών (a, b) με την αντεστραμμένη (b, a).
     """
-    scope = scope_step2(df, step1_col=step1_col_name)
-    pairs = mutual_pairs_in_scope(df, scope)
-    name2class = {
-        str(r["ΟΝΟΜΑ"]).strip(): str(r.get(step2_col_name))
-        for _, r in df.iterrows()
-        if pd.notna(r.get(step2_col_name))
-    }
-    broken = sum(1 for a, b in pairs if name2class.get(a) != name2class.get(b))
-    return int(broken)
+    names = df["ΟΝΟΜΑ"].astype(str).str.strip()
+    first_row = pd.Series(np.arange(len(df)), index=names.to_numpy())
+    first_row = first_row[~first_row.index.duplicated()]
+    if "ΦΙΛΟΙ" not in df.columns or first_row.empty:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    friends = df["ΦΙΛΟΙ"].to_numpy()[first_row.to_numpy()]
+    edges = pd.DataFrame({"a": first_row.index, "b": [_parse_friends_cell(x) for x in friends]}).explode("b")
+    edges = edges.dropna().drop_duplicates()
+    edges = edges[edges["a"] != edges["b"]]
+    mutual = edges.merge(edges.rename(columns={"a": "b", "b": "a"}), on=["a", "b"])
+    mutual = mutual[mutual["a"] < mutual["b"]]
+    return (first_row.loc[mutual["a"]].to_numpy(dtype=np.int64),
+            first_row.loc[mutual["b"]].to_numpy(dtype=np.int64))
 
 # --- Public API ---
 def export_step2_KL(df: pd.DataFrame, output_file: str, step1_col_name: str, step2_col_name: str, sheet_name: str = "SCENARIO") -> str:
@@ -145,9 +114,11 @@ def export_step2_KL(df: pd.DataFrame, output_file: str, step1_col_name: str, ste
     - K = ΒΗΜΑ1_ΣΕΝΑΡΙΟ_N
     - L = ΒΗΜΑ2_ΣΕΝΑΡΙΟ_N
     """
-    out = _ensure_KL_positions(df, step1_col_name=step1_col_name, step2_col_name=step2_col_name)
-    with pd.ExcelWriter(output_file, engine="openpyxl") as wr:
-        out.to_excel(wr, index=False, sheet_name=sheet_name)
+    workbook, header_format = open_streaming_workbook(output_file)
+    try:
+        _write_sheet(workbook, sheet_name, df, _KL_layout(df.columns, step1_col_name, step2_col_name), header_format)
+    finally:
+        workbook.close()
     return output_file
 
 def export_step2_sheets_KL(dfs_by_sid: dict[int, tuple[pd.DataFrame, str, str]], output_file: str) -> str:
@@ -157,21 +128,28 @@ def export_step2_sheets_KL(dfs_by_sid: dict[int, tuple[pd.DataFrame, str, str]],
     - Δημιουργεί sheet «ΣΠΑΣΜΕΝΕΣ_ΦΙΛΙΕΣ_ΒΗΜΑ2» με {ΣΕΝΑΡΙΟ, ΣΠΑΣΜΕΝΕΣ_ΦΙΛΙΕΣ}.
     """
     summary_rows = []
-    with pd.ExcelWriter(output_file, engine="openpyxl") as wr:
+    pairs_by_roster = {}
+    workbook, header_format = open_streaming_workbook(output_file)
+    try:
         for sid, (df, s1_col, s2_col) in sorted(dfs_by_sid.items(), key=lambda kv: kv[0]):
-            out = _ensure_KL_positions(df, s1_col, s2_col)
             sheet_name = f"S{sid}"
-            out.to_excel(wr, index=False, sheet_name=sheet_name)
+            _write_sheet(workbook, sheet_name, df, _KL_layout(df.columns, s1_col, s2_col), header_format)
 
             # Σύνοψη «σπασμένων» για το sid
             try:
-                broken = _count_broken_pairs(df, s1_col, s2_col)
+                roster = (tuple(df["ΟΝΟΜΑ"].tolist()), tuple(df["ΦΙΛΟΙ"].tolist()) if "ΦΙΛΟΙ" in df.columns else None)
+                if roster not in pairs_by_roster:
+                    pairs_by_roster[roster] = _mutual_pairs_rows(df)
+                broken = _count_broken_pairs(df, s1_col, s2_col, pairs_by_roster[roster])
             except Exception:
                 broken = 0
             summary_rows.append({"ΣΕΝΑΡΙΟ": sheet_name, "ΣΠΑΣΜΕΝΕΣ_ΦΙΛΙΕΣ": int(broken)})
 
         if summary_rows:
-            pd.DataFrame(summary_rows).to_excel(wr, index=False, sheet_name="ΣΠΑΣΜΕΝΕΣ_ΦΙΛΙΕΣ_ΒΗΜΑ2")
+            summary = pd.DataFrame(summary_rows)
+            _write_sheet(workbook, "ΣΠΑΣΜΕΝΕΣ_ΦΙΛΙΕΣ_ΒΗΜΑ2", summary, [(c, c) for c in summary.columns], header_format)
+    finally:
+        workbook.close()
     return output_file
 
 # Συμβατότητα με παλαιό όνομα
@@ -190,7 +168,8 @@ def export_step2_only_L(df: pd.DataFrame, output_file: str, step1_col_name: str
     return export_step2_KL(df, output_file, step1_col_name=step1_col_name, step2_col_name=step2_col_name, sheet_name=sheet_name)
 
 
-def _count_broken_pairs(df: pd.DataFrame, step1_col_name: str, step2_col_name: str) -> int:
+def _count_broken_pairs(df: pd.DataFrame, step1_col_name: str, step2_col_name: str,
+                        pairs: tuple[np.ndarray, np.ndarray] | None = None) -> int:
     """
     ΕΠΙΣΤΡΕΦΕΙ ΤΟ ΣΥΝΟΛΟ «Σπασμένων» πλήρως αμοιβαίων ΔΥΑΔΩΝ από ΒΗΜΑ 1 + ΒΗΜΑ 2.
     - Βήμα 1: αμοιβαίες δυάδες μεταξύ παιδιών εκπαιδευτικών (ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ=='Ν')
@@ -202,63 +181,42 @@ def _count_broken_pairs(df: pd.DataFrame, step1_col_name: str, step2_col_name: s
         * Μη-τοποθετημένος (Ζ/Ι) -> τάξη από Βήμα 2 (step2_col_name)
       Αν οι τάξεις διαφέρουν -> «σπασμένη».
     Επιστρέφεται: broken_step1 + broken_step2.
+    Το `pairs` (από _mutual_pairs_rows) επαναχρησιμοποιείται όταν τα φύλλα έχουν κοινό roster.
     """
-    # --- helpers ---
-    def yn(v): 
-        return str(v).strip().upper() == "Ν"
+    u, v = _mutual_pairs_rows(df) if pairs is None else pairs
 
-    by_name = df.set_index("ΟΝΟΜΑ", drop=False)
+    def raw(col: str) -> np.ndarray:
+        return (df[col].astype(str).str.strip() if col in df.columns else pd.Series("", index=df.index)).to_numpy()
 
-    def cls_from_step1(name: str) -> str:
-        if name not in by_name.index: 
-            return ""
-        c1 = by_name.loc[name].get(step1_col_name)
-        return str(c1).strip() if pd.notna(c1) else ""
+    def cls(col: str) -> np.ndarray:
+        # Τάξη ως str χωρίς κενά· "" όταν λείπει
+        if col not in df.columns:
+            return np.full(len(df), "", dtype=object)
+        return np.where(df[col].notna().to_numpy(), df[col].astype(str).str.strip().to_numpy(), "")
 
-    def cls_from_step2(name: str) -> str:
-        if name not in by_name.index: 
-            return ""
-        c2 = by_name.loc[name].get(step2_col_name)
-        return str(c2).strip() if pd.notna(c2) else ""
+    teacher = np.char.upper(raw("ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ").astype(str)) == "Ν"
+    placed = df[step1_col_name].notna().to_numpy()
+    c1, c2 = cls(step1_col_name), cls(step2_col_name)
+
+    def broken_in(scope: np.ndarray, classes: np.ndarray) -> int:
+        keep = scope[u] & scope[v]
+        ca, cb = classes[u[keep]], classes[v[keep]]
+        return int(np.count_nonzero((ca != "") & (cb != "") & (ca != cb)))
 
     # ------------------
     # Part A: Broken pairs from STEP 1 (teacher-kids only)
     # ------------------
-    teacher_scope = [n for n, row in by_name.iterrows() if yn(row.get("ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ", "")) and pd.notna(row.get(step1_col_name))]
-    teacher_pairs = mutual_pairs_in_scope(df, teacher_scope)
-    broken_step1 = 0
-    for a, b in teacher_pairs:
-        ca, cb = cls_from_step1(a), cls_from_step1(b)
-        if ca and cb and ca != cb:
-            broken_step1 += 1
+    broken_step1 = broken_in(teacher & placed, c1)
 
     # ------------------
     # Part B: Broken pairs from STEP 2 scope (teacher-kids + unplaced Z/I)
     # ------------------
-    scope = scope_step2(df, step1_col=step1_col_name)
-    pairs = mutual_pairs_in_scope(df, scope)
-
-    def cls_for_step2_rule(name: str) -> str:
-        if name not in by_name.index:
-            return ""
-        row = by_name.loc[name]
-        # Teacher kid -> class from Step 1
-        if yn(row.get("ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ", "")):
-            return cls_from_step1(name)
-        # Not placed in Step 1 (Z/I) -> class from Step 2
-        if pd.isna(row.get(step1_col_name)):
-            return cls_from_step2(name)
-        # Fallbacks: prefer Step 2 then Step 1
-        c2 = cls_from_step2(name)
-        if c2:
-            return c2
-        return cls_from_step1(name)
-
-    broken_step2 = 0
-    for a, b in pairs:
-        ca, cb = cls_for_step2_rule(a), cls_for_step2_rule(b)
-        if ca and cb and ca != cb:
-            broken_step2 += 1
+    # Scope όπως το scope_step2 (χωρίς upper), τάξη: παιδί εκπ/κού -> Βήμα 1,
+    # μη τοποθετημένος -> Βήμα 2, αλλιώς Βήμα 2 με fallback στο Βήμα 1
+    zi = (raw("ΖΩΗΡΟΣ") == "Ν") | (raw("ΙΔΙΑΙΤΕΡΟΤΗΤΑ") == "Ν")
+    scope = (~placed & zi) | (placed & (raw("ΠΑΙΔΙ_ΕΚΠΑΙΔΕΥΤΙΚΟΥ") == "Ν"))
+    rule = np.where(teacher, c1, np.where(~placed | (c2 != ""), c2, c1))
+    broken_step2 = broken_in(scope, rule)
 
     # Σύνολο που ζητάς να αποτυπώνεται στη σύνοψη Βήματος 2
     return int(broken_step1 + broken_step2)
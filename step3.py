@@ -2,7 +2,11 @@
 import pandas as pd
 import numpy as np
 import re
+import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from core_io_utils import open_streaming_workbook, write_sheet_rows
 
 MAX_CLASS_SIZE = 25
 
@@ -13,14 +17,15 @@ def parse_friends(cell):
     return {p.strip() for p in parts if p.strip()}
 
 def build_mutual_dyads(df, name_col='ΟΝΟΜΑ', friends_col='ΦΙΛΟΙ'):
-    friend_map = {row[name_col]: parse_friends(row[friends_col]) for _, row in df.iterrows()}
-    names = set(friend_map.keys())
-    dyads = set()
-    for a in names:
-        for b in friend_map[a]:
-            if b in names and a in friend_map.get(b, set()):
-                dyads.add(tuple(sorted([a,b])))
-    return sorted(list(dyads))
+    # One friend list per name (the last row wins for duplicate names)
+    rows = df[[name_col, friends_col]].drop_duplicates(subset=name_col, keep='last')
+    edges = pd.DataFrame({'a': rows[name_col].to_numpy(),
+                          'b': [list(parse_friends(cell)) for cell in rows[friends_col]]})
+    edges = edges.explode('b').dropna(subset=['b']).drop_duplicates()
+    # Reciprocity check as a join of (a, b) with (b, a)
+    mutual = edges.merge(edges.rename(columns={'a': 'b', 'b': 'a'}), on=['a', 'b'])
+    mutual = mutual[mutual['a'] <= mutual['b']]
+    return sorted(zip(mutual['a'], mutual['b']))
 
 def step3_assign(sheet_df, scenario_num, max_class_size=MAX_CLASS_SIZE):
     col_b1 = f'ΒΗΜΑ1_ΣΕΝΑΡΙΟ_{scenario_num}'
@@ -36,36 +41,41 @@ def step3_assign(sheet_df, scenario_num, max_class_size=MAX_CLASS_SIZE):
     if col_b1 in sheet_df.columns:
         assigned = assigned.where(~assigned.isna(), sheet_df[col_b1])
 
-    # Current class counts
+    # Current class counts; once every class is full no dyad can be completed
     counts = assigned.value_counts(dropna=True).to_dict()
+    open_classes = sum(1 for n in counts.values() if n < max_class_size)
 
     # Mutual DYADS only (Triads are not allowed per 22 Aug 2025 rule)
     dyads = build_mutual_dyads(sheet_df, name_col=name_col, friends_col='ΦΙΛΟΙ')
 
-    # Build index by name
-    name_to_idx = {row[name_col]: i for i, row in sheet_df.reset_index().iterrows()}
+    # Build index by name (position; the last row wins for duplicate names)
+    name_to_idx = dict(zip(sheet_df[name_col].tolist(), range(len(sheet_df))))
 
     # Place the unplaced member of each dyad if the other is already placed and capacity allows
+    values = assigned.tolist()
+    missing = assigned.isna().tolist()
+    placed = {}
     for a, b in dyads:
+        if not open_classes:
+            break
         ia = name_to_idx.get(a)
         ib = name_to_idx.get(b)
         if ia is None or ib is None:
             continue
-        class_a = assigned.iloc[ia]
-        class_b = assigned.iloc[ib]
         # exactly one assigned
-        if pd.isna(class_a) ^ pd.isna(class_b):
-            target = class_a if not pd.isna(class_a) else class_b
-            if pd.isna(target):
-                continue
-            counts.setdefault(target, 0)
-            if counts[target] < max_class_size:
-                if pd.isna(class_a):
-                    assigned.iloc[ia] = target
-                else:
-                    assigned.iloc[ib] = target
-                counts[target] += 1
-            # else leave unassigned for Step5
+        if missing[ia] == missing[ib]:
+            continue
+        src, dst = (ib, ia) if missing[ia] else (ia, ib)
+        target = values[src]
+        if counts.get(target, 0) < max_class_size:
+            values[dst] = target
+            missing[dst] = False
+            placed[dst] = target
+            counts[target] = counts.get(target, 0) + 1
+            open_classes -= counts[target] == max_class_size
+        # else leave unassigned for Step5
+    if placed:
+        assigned.iloc[list(placed)] = list(placed.values())
 
     # Insert the new column at position 12 (Excel 'M')
     out_df = sheet_df.copy()
@@ -78,20 +88,49 @@ def step3_assign(sheet_df, scenario_num, max_class_size=MAX_CLASS_SIZE):
     out_df = out_df[new_cols]
     return out_df
 
+def _sheet_scenario(sheet):
+    m = re.search(r'(\d+)', sheet)
+    return int(m.group(1)) if m else 1
+
+def _write_sheet_rows(workbook, sheet, df, header_format):
+    # Positional layout, so the duplicate ΒΗΜΑ3 column name is fine; dates come back
+    # as dates (default_date_format in the shared writer), not Excel serial numbers
+    write_sheet_rows(workbook, sheet, [(c, df.iloc[:, i]) for i, c in enumerate(df.columns)], header_format)
+
+def step3_workbook(in_path, out_path, workers=1):
+    # Open the workbook once and parse every scenario sheet in one pass
+    sheets = pd.read_excel(in_path, sheet_name=None)
+    names = list(sheets)
+    scens = [_sheet_scenario(sheet) for sheet in names]
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(names)))
+
+    # Sheets are solved in a process pool (workers=1: sequential) and each one is
+    # streamed to the output, in sheet order, as soon as it is ready
+    workbook, header_format = open_streaming_workbook(out_path)
+    try:
+        if workers == 1:
+            results = map(step3_assign, sheets.values(), scens)
+            for sheet, out_df in zip(names, results):
+                _write_sheet_rows(workbook, sheet, out_df, header_format)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(step3_assign, sheets.values(), scens)
+                for sheet, out_df in zip(names, results):
+                    _write_sheet_rows(workbook, sheet, out_df, header_format)
+    finally:
+        workbook.close()
+    return out_path
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--in', dest='in_path', required=True, help='Path to VIMA2 Excel (sheets S1,S2,S3).')
     parser.add_argument('--out', dest='out_path', required=True, help='Output Excel with ΒΗΜΑ3_ΣΕΝΑΡΙΟ_N in column M.')
+    parser.add_argument('--workers', type=int, default=1, help='Parallel sheets (0 = all cores, 1 = sequential).')
     args = parser.parse_args()
 
-    xls = pd.ExcelFile(args.in_path)
-    with pd.ExcelWriter(args.out_path, engine='xlsxwriter') as writer:
-        for sheet in xls.sheet_names:
-            df = pd.read_excel(args.in_path, sheet_name=sheet)
-            m = re.search(r'(\d+)', sheet)
-            scen = int(m.group(1)) if m else 1
-            out_df = step3_assign(df, scen)
-            out_df.to_excel(writer, index=False, sheet_name=sheet)
+    step3_workbook(args.in_path, args.out_path, workers=args.workers)
 
 if __name__ == '__main__':
     main()
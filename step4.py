@@ -12,12 +12,13 @@ Step 4 – Fully mutual groups placement (ΠΛΗΡΩΣ ΔΙΟΡΘΩΜΕΝΗ ΕΚ
 - ΠΡΟΣΘΗΚΗ: wrapper function run_step4() για compatibility με σελίδες
 """
 
+import heapq
 import itertools
 from collections import defaultdict
 from copy import deepcopy
 import pandas as pd
 import math
-from typing import List, Dict, Tuple, Optional, Set
+from typing import Any, List, Dict, Tuple, Optional, Set
 
 def _auto_num_classes(df: pd.DataFrame, override: Optional[int] = None) -> int:
     """Αυτόματος υπολογισμός αριθμού τμημάτων βάσει αριθμού μαθητών."""
@@ -67,10 +68,34 @@ def has_broken_friendship(name: str, df: pd.DataFrame) -> bool:
     except (IndexError, KeyError):
         return False
 
+def _friend_index(df: pd.DataFrame) -> Dict[Any, Set[Any]]:
+    """
+    Σύνολο φίλων ανά όνομα, από την πρώτη γραμμή με αυτό το όνομα (όπως τα
+    lookups `.values[0]`). Κελιά που δεν είναι συλλογές δίνουν κενό σύνολο.
+    """
+    index = {}
+    for name, friends in zip(df['ΟΝΟΜΑ'].tolist(), df['ΦΙΛΟΙ'].tolist()):
+        if name in index:
+            continue
+        try:
+            index[name] = set(friends)
+        except TypeError:
+            index[name] = set()
+    return index
+
+def _are_mutual(a: Any, b: Any, friends: Dict[Any, Set[Any]]) -> bool:
+    """Ίδιο αποτέλεσμα με is_fully_mutual([a, b], df), με lookups στο ευρετήριο φίλων."""
+    return a in friends and b in friends and b in friends[a] and a in friends[b]
+
 def create_fully_mutual_groups(df: pd.DataFrame, assigned_column: str) -> List[List[str]]:
     """
     Δημιουργία ΜΟΝΟ ΔΥΑΔΩΝ (όχι τριάδων) μεταξύ μη-τοποθετημένων μαθητών.
     Αποκλεισμός μαθητών με σπασμένες φιλίες από προηγούμενα βήματα.
+
+    Οι αμοιβαίες δυάδες βρίσκονται από τις αμοιβαίες ακμές του ευρετηρίου φίλων
+    (O(E)). Κάθε μαθητής, με τη σειρά του pool, ζευγαρώνει με τον πρώτο επόμενο
+    ελεύθερο αμοιβαίο φίλο του: ίδιο αποτέλεσμα με το άπληστο πέρασμα στα
+    itertools.combinations του pool.
     """
     unassigned = df[df[assigned_column].isna()].copy()
     
@@ -83,32 +108,37 @@ def create_fully_mutual_groups(df: pd.DataFrame, assigned_column: str) -> List[L
         return []
     
     names = list(unassigned['ΟΝΟΜΑ'].astype(str).unique())
+    friends = _friend_index(df)
     
     # Αποκλεισμός μαθητών με σπασμένες φιλίες
-    names_no_broken = [name for name in names if not has_broken_friendship(name, df)]
+    if 'ΣΠΑΣΜΕΝΕΣ_ΦΙΛΙΕΣ' in df.columns:
+        broken = {}
+        for name, flag in zip(df['ΟΝΟΜΑ'].tolist(), df['ΣΠΑΣΜΕΝΕΣ_ΦΙΛΙΕΣ'].tolist()):
+            broken.setdefault(name, bool(flag))
+        names_no_broken = [name for name in names if not broken.get(name, False)]
+    else:
+        names_no_broken = names
     
-    # Επιπλέον φιλτράρισμα: αποκλεισμός μαθητών χωρίς αμοιβαίες φιλίες στο pool
-    names_with_mutual = []
-    for name in names_no_broken:
-        try:
-            friends = set(df.loc[df['ΟΝΟΜΑ'] == name, 'ΦΙΛΟΙ'].values[0])
-            mutual_friends_in_pool = friends.intersection(set(names_no_broken))
-            if len(mutual_friends_in_pool) > 0:
-                names_with_mutual.append(name)
-        except (IndexError, KeyError):
-            continue
+    # Επιπλέον φιλτράρισμα: αποκλεισμός μαθητών χωρίς φίλους στο pool
+    pool = set(names_no_broken)
+    names = [name for name in names_no_broken if name in friends and not friends[name].isdisjoint(pool)]
     
-    names = names_with_mutual
+    position = {name: i for i, name in enumerate(names)}
     used = set()
     groups = []
 
     # ΜΟΝΟ ΔΥΑΔΕΣ (σύμφωνα με έγγραφο - όχι τριάδες)
-    for g in itertools.combinations(names, 2):
-        if set(g) & used:
+    for i, a in enumerate(names):
+        if a in used:
             continue
-        if is_fully_mutual(list(g), df):
-            groups.append(list(g))
-            used |= set(g)
+        later = sorted(position[b] for b in friends[a]
+                       if b in position and position[b] > i and _are_mutual(a, b, friends))
+        for j in later:
+            b = names[j]
+            if b not in used:
+                groups.append([a, b])
+                used.update((a, b))
+                break
 
     return groups
 
@@ -118,9 +148,10 @@ def get_group_characteristics(group: List[str], df: pd.DataFrame) -> str:
     ΔΙΟΡΘΩΜΕΝΗ ΕΚΔΟΣΗ: Πλήρης διαχείριση όλων των κατηγοριών.
     """
     sub = df[df['ΟΝΟΜΑ'].isin(group)]
-    genders = set(sub['ΦΥΛΟ'])
-    lang = set(sub['ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ'])
-    
+    return _category_label(set(sub['ΦΥΛΟ']), set(sub['ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ']))
+
+def _category_label(genders: Set[Any], lang: Set[Any]) -> str:
+    """Κατηγορία ομάδας από τα σύνολα τιμών φύλου και γνώσης ελληνικών των μελών της."""
     # Μικτό φύλο ως ενιαία κατηγορία (αγνοεί Ν/Ο)
     if len(genders) > 1:
         return 'Ομάδες Μικτού Φύλου'
@@ -136,6 +167,38 @@ def get_group_characteristics(group: List[str], df: pd.DataFrame) -> str:
     
     return f'{ltxt} ({gtxt})'
 
+def _group_attribute_table(groups: List[List[str]], df: pd.DataFrame) -> Tuple[List[int], List[int], List[int], List[int], List[int], List[str]]:
+    """
+    Πίνακας χαρακτηριστικών των ομάδων, υπολογισμένος μία φορά με ένα πέρασμα στο df.
+
+    Returns:
+        (μέγεθος, καλή γνώση, αγόρια, κορίτσια, κωδικός κατηγορίας) ανά ομάδα και
+        τα ονόματα κατηγοριών ανά κωδικό (με σειρά πρώτης εμφάνισης)
+    """
+    rows = defaultdict(list)
+    for pos, name in enumerate(df['ΟΝΟΜΑ'].tolist()):
+        rows[name].append(pos)
+    gender = df['ΦΥΛΟ'].tolist()
+    lang = df['ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ'].tolist()
+
+    sizes, good, boys, girls, codes = [], [], [], [], []
+    category_names: List[str] = []
+    code_of: Dict[str, int] = {}
+    for g in groups:
+        members = [pos for name in set(g) for pos in rows.get(name, ())]
+        genders = {gender[pos] for pos in members}
+        langs = {lang[pos] for pos in members}
+        category = _category_label(genders, langs)
+        if category not in code_of:
+            code_of[category] = len(category_names)
+            category_names.append(category)
+        sizes.append(len(g))
+        good.append(sum(1 for pos in members if lang[pos] == 'Ν'))
+        boys.append(sum(1 for pos in members if gender[pos] == 'Α'))
+        girls.append(sum(1 for pos in members if gender[pos] == 'Κ'))
+        codes.append(code_of[category])
+    return sizes, good, boys, girls, codes, category_names
+
 def categorize_groups(groups: List[List[str]], df: pd.DataFrame) -> Dict[str, List[List[str]]]:
     """Ομαδοποίηση των ομάδων βάσει χαρακτηριστικών."""
     cat = defaultdict(list)
@@ -287,13 +350,42 @@ def penalty(cnt: Dict[str, int], good: Dict[str, int], boys: Dict[str, int], gir
     
     return sum(penalties)
 
+def _min_spread(values: List[int], extra: int) -> int:
+    """
+    Κάτω φράγμα για το max-min των τμημάτων αν μοιραστούν ακόμη `extra` μονάδες
+    (μη αρνητικές προσθήκες, χωρίς τον περιορισμό ότι έρχονται ανά ομάδα).
+    """
+    v = sorted(values)
+    k = len(v)
+    level, left = v[0], extra
+    # Γέμισμα «νερού»: το μέγιστο δυνατό ελάχιστο τμήμα με τις διαθέσιμες μονάδες
+    for i in range(1, k + 1):
+        step = i * ((v[i] if i < k else math.inf) - level)
+        if left < step:
+            level += left // i
+            break
+        left -= step
+        level = v[i]
+    return max(v[-1], -(-(sum(v) + extra) // k)) - level
+
 # -------------------- Enhanced Algorithm with IMPROVED Category Strategy --------------------
 
 def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str = 'ΒΗΜΑ3_ΣΕΝΑΡΙΟ_1', 
                                       num_classes: Optional[int] = None, max_results: int = 5, 
-                                      max_nodes: int = None, exhaustive: bool = False) -> List[Tuple[Dict[Tuple[str, ...], str], int]]:
+                                      max_nodes: int = None, exhaustive: bool = False,
+                                      debug: bool = False, prune: bool = True) -> List[Tuple[Dict[Tuple[str, ...], str], int]]:
     """
     ΠΛΗΡΩΣ ΔΙΟΡΘΩΜΕΝΗ ΕΚΔΟΣΗ με πραγματική στρατηγική εναλλαγής κατηγοριών.
+
+    Με debug=True εκτυπώνεται η προτιμώμενη σειρά τμημάτων σε κάθε κόμβο του DFS.
+
+    Με prune=True το DFS κλαδεύει με κάτω φράγμα: για πλήθος, καλή γνώση, αγόρια
+    και κορίτσια, η τρέχουσα διαφορά max-min με το καλύτερο δυνατό μοίρασμα των
+    ομάδων που απομένουν (_min_spread). Κόβονται οι κλάδοι που δεν μπορούν να
+    περάσουν το accept και, σε exhaustive mode, όσοι δεν μπορούν να πάρουν penalty
+    μικρότερο από το max_results-οστό καλύτερο σενάριο. Τα αποτελέσματα είναι ίδια
+    με την πλήρη αναζήτηση (prune=False). Χωρίς exhaustive, το κλάδεμα ισχύει μόνο
+    αν δεν υπάρχει max_nodes, ώστε να μην αλλάζει ποια σενάρια βρίσκονται στο όριο κόμβων.
     """
     num_classes = _auto_num_classes(df, num_classes)
     classes = [f'Α{i+1}' for i in range(num_classes)]
@@ -309,23 +401,35 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
     if not groups:
         return []
 
-    # Κατηγοριοποίηση ομάδων για στρατηγική
-    categorized_groups = categorize_groups(groups, df)
+    # Χαρακτηριστικά ομάδων μία φορά: το DFS διαβάζει μόνο αυτούς τους πίνακες
+    sizes, goods, boys_of, girls_of, codes, category_names = _group_attribute_table(groups, df)
+
+    # Κατηγοριοποίηση ομάδων για στρατηγική (δείκτες ομάδων ανά κατηγορία)
+    categorized_groups = defaultdict(list)
+    for i, code in enumerate(codes):
+        categorized_groups[category_names[code]].append(i)
     
     # Καταμέτρηση υπάρχουσων ομάδων ανά κατηγορία ανά τμήμα (από Βήματα 1-3)
     # ΒΕΛΤΙΩΣΗ: Εντοπισμός διατηρημένων ζευγαριών από προηγούμενα βήματα
     detected_pairs = []
     assigned_students = df[~df[assigned_column].isna()]
     
+    friends = _friend_index(df)
+    
     # Εντοπισμός ζευγαριών που ήδη βρίσκονται στο ίδιο τμήμα
     for class_name in classes:
         class_students = assigned_students[assigned_students[assigned_column] == class_name]['ΟΝΟΜΑ'].tolist()
+        positions = defaultdict(list)
+        for j, student in enumerate(class_students):
+            positions[student].append(j)
         
-        # Έλεγχος όλων των συνδυασμών για αμοιβαίες φιλίες
+        # Αμοιβαίες φιλίες μόνο μέσω των ακμών του ευρετηρίου, με τη σειρά (i, j) των συνδυασμών
+        found = []
         for i, student1 in enumerate(class_students):
-            for student2 in class_students[i+1:]:
-                if is_fully_mutual([student1, student2], df):
-                    detected_pairs.append((student1, student2))
+            for friend in friends.get(student1, ()):
+                if _are_mutual(student1, friend, friends):
+                    found.extend((i, j) for j in positions.get(friend, ()) if j > i)
+        detected_pairs.extend((class_students[i], class_students[j]) for i, j in sorted(found))
     
     existing_groups_per_class = count_groups_by_category_per_class_strict(
         df, assigned_column, classes, detected_pairs=detected_pairs
@@ -333,9 +437,9 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
     
     # Υπολογισμός συνολικών ομάδων ανά κατηγορία (υπάρχουσες + νέες)
     total_groups_per_category = {}
-    for category, group_list in categorized_groups.items():
+    for category, members in categorized_groups.items():
         existing_total = sum(existing_groups_per_class[c].get(category, 0) for c in classes)
-        total_groups_per_category[category] = existing_total + len(group_list)
+        total_groups_per_category[category] = existing_total + len(members)
     
     # Υπολογισμός ιδανικής διανομής ανά κατηγορία
     ideal_per_category = calculate_ideal_distribution(total_groups_per_category, classes)
@@ -344,35 +448,54 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
     print(f"📋 Υπάρχουσες ομάδες ανά τμήμα: {dict(existing_groups_per_class)}")
 
     # Επιπεδοποίηση ομάδων με προτεραιότητα βάσει ανάγκης κατηγοριών
-    def group_priority_with_category_balance(g: List[str]) -> Tuple[int, int, int]:
-        category = get_group_characteristics(g, df)
+    def group_priority_with_category_balance(i: int) -> Tuple[int, int, int]:
+        category = category_names[codes[i]]
         
         # Υπολογισμός πόσο χρειάζεται αυτή η κατηγορία σε όλα τα τμήματα
         current_total = sum(existing_groups_per_class[c].get(category, 0) for c in classes)
         ideal_total = ideal_per_category.get(category, 1)
         need_score = max(0, ideal_total - current_total)  # Μεγαλύτερο = περισσότερο χρειάζεται
         
-        sub = df[df['ΟΝΟΜΑ'].isin(g)]
-        boys = int((sub['ΦΥΛΟ']=='Α').sum())
-        girls= int((sub['ΦΥΛΟ']=='Κ').sum())
-        
         # Προτεραιότητα: need_score desc, size desc, gender balance desc
-        return (-need_score, -len(g), -abs(boys-girls))
+        return (-need_score, -sizes[i], -abs(boys_of[i]-girls_of[i]))
     
     all_groups = []
-    for group_list in categorized_groups.values():
-        all_groups.extend(group_list)
-    
-    groups = sorted(all_groups, key=group_priority_with_category_balance)
-
-    results = []
+    for members in categorized_groups.values():
+        all_groups.extend(members)
+    
+    order = sorted(all_groups, key=group_priority_with_category_balance)
+    groups = [groups[i] for i in order]
+    keys = [tuple(g) for g in groups]
+    sizes, goods, boys_of, girls_of = ([col[i] for i in order] for col in (sizes, goods, boys_of, girls_of))
+    codes = [codes[i] for i in order]
+
+    # Ανά κωδικό κατηγορίας: ιδανικό πλήθος, αντίθετη κατηγορία και υπάρχουσες ομάδες ανά τμήμα
+    code_of = {name: code for code, name in enumerate(category_names)}
+    ideal_of = [ideal_per_category.get(name, 1) for name in category_names]
+    opposite_of = [code_of.get(get_opposite_category(name)) for name in category_names]
+    existing_of = {c: [existing_groups_per_class[c].get(name, 0) for name in category_names] for c in classes}
+
+    # Τα καλύτερα max_results σενάρια ως (-penalty, -σειρά εύρεσης, placement): στην κορυφή το χειρότερο
+    best = []
+    found = 0
     nodes = 0
     placed = {}
     
-    # Παρακολούθηση τελευταίας τοποθετημένης κατηγορίας ανά τμήμα για εναλλαγή
+    # Υπόλοιπα ανά θέση: σύνολο μεγέθους / καλής γνώσης / αγοριών / κοριτσιών των ομάδων idx, idx+1, ...
+    rest = [(0, 0, 0, 0)]
+    for i in range(len(groups) - 1, -1, -1):
+        r = rest[-1]
+        rest.append((r[0] + sizes[i], r[1] + goods[i], r[2] + boys_of[i], r[3] + girls_of[i]))
+    rest.reverse()
+    bounded = prune and (exhaustive or not max_nodes)
+    
+    # Μετρητές ομάδων ανά τμήμα και κατηγορία για το τρέχον placement (ενημέρωση σε place/backtrack)
+    placed_of = {c: [0] * len(category_names) for c in classes}
+    
+    # Παρακολούθηση τελευταίας τοποθετημένης κατηγορίας (κωδικός) ανά τμήμα για εναλλαγή
     last_category_per_class = {c: None for c in classes}
 
-    def get_preferred_class_for_group(group: List[str], cnt: Dict[str, int], 
+    def get_preferred_class_for_group(idx: int, cnt: Dict[str, int], 
                                      good: Dict[str, int], boys: Dict[str, int], girls: Dict[str, int]) -> List[str]:
         """
         ΒΕΛΤΙΩΜΕΝΗ στρατηγική: Καθορισμός προτιμώμενης σειράς τμημάτων βάσει:
@@ -380,7 +503,7 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
         2. Στρατηγικής εναλλαγής κατηγοριών
         3. Load balancing
         """
-        category = get_group_characteristics(group, df)
+        code = codes[idx]
         
         # Έναρξη με load balancing
         order = sorted(classes, key=lambda c: (cnt[c], good[c], boys[c]+girls[c]))
@@ -390,18 +513,12 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
         alternation_preferred = []
         other_classes = []
         
-        opposite_category = get_opposite_category(category)
-        ideal_for_category = ideal_per_category.get(category, 1)
+        opposite_category = opposite_of[code]
+        ideal_for_category = ideal_of[code]
         
         for c in order:
-            current_groups_in_category = existing_groups_per_class[c].get(category, 0)
-            
-            # Προσθέτουμε τις ήδη τοποθετημένες ομάδες αυτής της κατηγορίας σε αυτό το placement
-            groups_placed_here = sum(1 for placed_group, placed_class in placed.items() 
-                                   if placed_class == c and 
-                                   get_group_characteristics(list(placed_group), df) == category)
-            
-            current_total = current_groups_in_category + groups_placed_here
+            # Υπάρχουσες ομάδες της κατηγορίας + όσες έχουν ήδη τοποθετηθεί σε αυτό το placement
+            current_total = existing_of[c][code] + placed_of[c][code]
             
             # ΠΡΟΤΕΡΑΙΟΤΗΤΑ 1: Τμήματα που υπολείπονται από τον ιδανικό αριθμό
             if current_total < ideal_for_category:
@@ -417,14 +534,14 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
         final_order = ideal_preferred + alternation_preferred + other_classes
         
         # DEBUG: Εκτύπωση στρατηγικής για debugging
-        if len(final_order) > 0:
-            print(f"🎯 Ομάδα {group} ({category}) → Προτιμώμενη σειρά: {final_order[:3]}")
+        if debug and len(final_order) > 0:
+            print(f"🎯 Ομάδα {groups[idx]} ({category_names[code]}) → Προτιμώμενη σειρά: {final_order[:3]}")
         
         return final_order
 
     def dfs(idx: int, cnt: Dict[str, int], good: Dict[str, int], 
             boys: Dict[str, int], girls: Dict[str, int]) -> None:
-        nonlocal nodes
+        nonlocal nodes, found
         nodes += 1
         
         # Έλεγχος ορίων μόνο αν δεν είναι exhaustive mode
@@ -435,24 +552,43 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
         if any(v > 25 for v in cnt.values()):
             return
 
+        if bounded and idx < len(groups):
+            r_size, r_good, r_boys, r_girls = rest[idx]
+            pop_diff = _min_spread(list(cnt.values()), r_size)
+            good_diff = _min_spread(list(good.values()), r_good)
+            boys_diff = _min_spread(list(boys.values()), r_boys)
+            girls_diff = _min_spread(list(girls.values()), r_girls)
+            # Κανένα φύλλο του κλάδου δεν περνά το accept
+            if (pop_diff > 2 or good_diff > 4 or boys_diff > 3 or girls_diff > 3
+                    or sum(cnt.values()) + r_size > 25 * len(classes)):
+                return
+            # Κανένα φύλλο του κλάδου δεν μπαίνει στα max_results καλύτερα (οι ισοβαθμίες χάνουν από τα προγενέστερα)
+            if exhaustive and best and len(best) >= max_results:
+                bound = max(0, pop_diff - 1) + max(0, good_diff - 2) + max(0, boys_diff - 1) + max(0, girls_diff - 1)
+                if bound >= -best[0][0]:
+                    return
+
         # Base case: όλες οι ομάδες επεξεργάστηκαν
         if idx == len(groups):
             if accept(cnt, good, boys, girls):
+                found += 1
                 p = penalty(cnt, good, boys, girls, classes)
-                results.append((deepcopy(placed), p))
+                if len(best) < max_results:
+                    heapq.heappush(best, (-p, -found, deepcopy(placed)))
+                elif best and (-p, -found) > best[0][:2]:
+                    heapq.heapreplace(best, (-p, -found, deepcopy(placed)))
             return
 
         # Τρέχουσα ομάδα προς τοποθέτηση
-        g = groups[idx]
-        category = get_group_characteristics(g, df)
-        sub = df[df['ΟΝΟΜΑ'].isin(g)]
-        gsize = len(g)
-        ggood = int((sub['ΚΑΛΗ_ΓΝΩΣΗ_ΕΛΛΗΝΙΚΩΝ']=='Ν').sum())
-        gboys = int((sub['ΦΥΛΟ']=='Α').sum())
-        ggirls= int((sub['ΦΥΛΟ']=='Κ').sum())
+        key = keys[idx]
+        category = codes[idx]
+        gsize = sizes[idx]
+        ggood = goods[idx]
+        gboys = boys_of[idx]
+        ggirls= girls_of[idx]
 
         # Λήψη προτιμώμενης σειράς τμημάτων χρησιμοποιώντας στρατηγική κατηγοριών
-        preferred_order = get_preferred_class_for_group(g, cnt, good, boys, girls)
+        preferred_order = get_preferred_class_for_group(idx, cnt, good, boys, girls)
 
         for c in preferred_order:
             # Προσομοίωση τοποθέτησης
@@ -460,7 +596,8 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
             good[c]  += ggood
             boys[c]  += gboys
             girls[c] += ggirls
-            placed[tuple(g)] = c
+            placed[key] = c
+            placed_of[c][category] += 1
             
             # Ενημέρωση παρακολούθησης εναλλαγής
             old_category = last_category_per_class[c]
@@ -472,21 +609,22 @@ def apply_step4_with_enhanced_strategy(df: pd.DataFrame, assigned_column: str =
 
             # Backtrack
             last_category_per_class[c] = old_category
-            placed.pop(tuple(g), None)
+            placed.pop(key, None)
+            placed_of[c][category] -= 1
             cnt[c]   -= gsize
             good[c]  -= ggood
             boys[c]  -= gboys
             girls[c] -= ggirls
 
             # Early termination μόνο αν δεν είναι exhaustive mode
-            if not exhaustive and len(results) >= max_results:
+            if not exhaustive and found >= max_results:
                 return
 
     # Έναρξη DFS
     dfs(0, base_cnt.copy(), base_good.copy(), base_boys.copy(), base_girls.copy())
 
-    # Ταξινόμηση βάσει penalty score (καλύτερα πρώτα)
-    results_sorted = sorted(results, key=lambda t: t[1])[:max_results]
+    # Ταξινόμηση βάσει penalty score (καλύτερα πρώτα, σε ισοβαθμία με σειρά εύρεσης)
+    results_sorted = [(p_dict, -neg_p) for neg_p, _, p_dict in sorted(best, key=lambda t: (-t[0], -t[1]))]
     return results_sorted
 
 def export_step4_scenarios(df: pd.DataFrame, results: List[Tuple[Dict[Tuple[str, ...], str], int]], 